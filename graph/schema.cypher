@@ -7,3 +7,10 @@ CREATE INDEX IF NOT EXISTS FOR (n:IfcSpace) ON (n.name);
 CREATE INDEX IF NOT EXISTS FOR (n:IfcBuildingStorey) ON (n.name);
 CREATE INDEX IF NOT EXISTS FOR (n:IfcSystem) ON (n.name);
 CREATE INDEX IF NOT EXISTS FOR (n:IfcDistributionElement) ON (n.name, n.type);
+
+// Full-text (Lucene) indexes on names and the promoted pset Reference (n.reference);
+// rag/query.py lexical seeds query them instead of scanning
+CREATE FULLTEXT INDEX ifcName IF NOT EXISTS
+FOR (n:IfcEntity) ON EACH [n.name];
+CREATE FULLTEXT INDEX ifcReference IF NOT EXISTS
+FOR (n:IfcEntity) ON EACH [n.reference];
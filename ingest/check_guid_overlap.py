@@ -14,11 +14,8 @@ MECH_IFC = "data/raw/ifc/sample_hospital/SampleHospital_Ifc2x3_Mech.ifc"
 
 def all_guids(ifc_path):
     f = ifcopenshell.open(ifc_path)
-    s = set()
-    for e in f:
-        gid = getattr(e, "GlobalId", None)
-        if gid: s.add(gid)
-    return s
+    # only IfcRoot subtypes carry a GlobalId; skips the geometry entities entirely
+    return {e.GlobalId for e in f.by_type("IfcRoot") if e.GlobalId}
 
 ifc_guids = all_guids(MECH_IFC)
 print("MECH IFC GUIDs:", len(ifc_guids))
@@ -26,11 +23,14 @@ print("MECH IFC GUIDs:", len(ifc_guids))
 drv = GraphDatabase.driver(URI, auth=(USER, PASS))
 with drv.session(database=DB) as s:
     # pull only MECH-sourced nodes to keep it relevant
-    db = s.run("MATCH (n:IfcEntity) WHERE n.source IN ['Mech','Mechanical','MechJSON','MEP'] RETURN n.globalId AS id")
-    db_guids = {r["id"] for r in db if r["id"]}
+    # DISTINCT and the empty-id filter run in Cypher, so db_ids is the distinct non-empty
+    # guid list without a second set built here (globalId uniqueness is not assumed)
+    db_ids = s.run("MATCH (n:IfcEntity) WHERE n.source IN ['Mech','Mechanical','MechJSON','MEP'] "
+                   "AND n.globalId IS NOT NULL AND n.globalId <> '' "
+                   "RETURN DISTINCT n.globalId AS id").value("id")
+    overlap = {gid for gid in db_ids if gid in ifc_guids}
 
-overlap = ifc_guids & db_guids
-print("DB MECH nodes:", len(db_guids))
+print("DB MECH nodes:", len(db_ids))
 print("GUID overlap:", len(overlap))
 if overlap:
     print("sample overlap:", list(sorted(overlap))[:10])
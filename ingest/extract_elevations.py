@@ -1,8 +1,13 @@
 # ingest/extract_elevations.py
-import os, json, pathlib, argparse
-from typing import Any, Dict, Optional, List, Set
+import os, sys, json, pathlib, argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, List, Set, Tuple
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
+try:
+    import orjson  # faster parse straight from bytes
+except ImportError:
+    orjson = None
 
 load_dotenv()
 URI  = os.getenv("NEO4J_URI", "bolt://localhost:7687")
@@ -10,6 +15,27 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+BATCH = 10000  # rows per UNWIND write
+WRITERS = int(os.getenv("NEO4J_WRITERS", "4"))  # concurrent n.z batch writers
+
+# same constraint as graph/schema.cypher; idempotent
+GID_CONSTRAINT_Q = "CREATE CONSTRAINT ifcentity_gid IF NOT EXISTS FOR (n:IfcEntity) REQUIRE n.globalId IS UNIQUE"
+
+STOREY_ELEV_Q = "UNWIND $rows AS r MATCH (st:IfcEntity:IfcBuildingStorey {globalId:r.id}) SET st.elev = r.z"
+NODE_Z_Q = "UNWIND $rows AS r MATCH (n:IfcEntity {globalId:r.id}) SET n.z = r.z"
+# Storeys still lacking elev get the mean Z of their contained elements
+STOREY_FILL_Q = """
+UNWIND $pairs AS p
+MATCH (st:IfcEntity:IfcBuildingStorey {globalId:p.sid})
+WHERE st.elev IS NULL
+UNWIND p.kids AS kid
+MATCH (n:IfcEntity {globalId:kid})
+WITH st, avg(n.z) AS av
+WHERE av IS NOT NULL
+SET st.elev = av
+RETURN count(st) AS c
+"""
+
 def first(d: Dict, *keys):
     for k in keys:
         if k in d: return d[k]
@@ -28,6 +54,18 @@ def _as_float_primitive(x) -> Optional[float]:
 
 def as_number(x) -> Optional[float]:
     """Robust numeric unwrapping: dicts with 'value', ifc wrappers, 1-elem lists/tuples."""
+    # fast paths: bare numbers and {"type":..., "value": <number>} cover nearly every call
+    t = type(x)
+    if t is float: return x
+    if t is int: return float(x)
+    if t is dict:
+        v = x.get("value")
+        tv = type(v)
+        if tv is float: return v
+        if tv is int: return float(v)
+    return _as_number_generic(x)
+
+def _as_number_generic(x) -> Optional[float]:
     if x is None:
         return None
     if isinstance(x, (int, float, str)):
@@ -65,6 +103,8 @@ def as_number(x) -> Optional[float]:
 class IfcResolver:
     def __init__(self, inst: Dict[str, Dict]):
         self.inst = inst
+        # id(placement dict) -> Z summed from it up to the root; siblings share parents
+        self._z_cache: Dict[int, float] = {}
 
     def deref(self, x: Any) -> Optional[Dict]:
         if x is None:
@@ -78,45 +118,59 @@ class IfcResolver:
             return self.inst.get(x)
         return None
 
-    def coords_from_point(self, cp: Dict) -> Optional[List[float]]:
+    def coords_from_point(self, cp: Dict) -> Optional[Tuple[float, float, float]]:
+        """(x, y, z) with missing components as 0.0; None if no coordinate parses."""
         pts = first(cp, "Coordinates", "coordinates")
         # list variant
         if isinstance(pts, list):
-            vals = [as_number(v) for v in pts]
-            vals = [v for v in vals if v is not None]
-            if vals:
-                return vals
-            return None
+            n = len(pts)
+            x = as_number(pts[0]) if n > 0 else None
+            y = as_number(pts[1]) if n > 1 else None
+            z = as_number(pts[2]) if n > 2 else None
         # dict variant with x/y/z (each can be wrapped)
-        if isinstance(pts, dict):
-            out = []
-            for k in ("x","X","y","Y","z","Z"):
-                if k in pts:
-                    out.append(as_number(pts[k]))
-            out = [v for v in out if v is not None]
-            return out or None
-        return None
+        elif isinstance(pts, dict):
+            x = as_number(pts["x"] if "x" in pts else pts.get("X"))
+            y = as_number(pts["y"] if "y" in pts else pts.get("Y"))
+            z = as_number(pts["z"] if "z" in pts else pts.get("Z"))
+        else:
+            return None
+        if x is None and y is None and z is None:
+            return None
+        return (x or 0.0, y or 0.0, z or 0.0)
 
     def z_from_local_placement(self, lp: Dict) -> Optional[float]:
         seen: Set[str] = set()
-        z_total = 0.0
+        path: List[Dict] = []     # placements walked, child first
+        own: List[float] = []     # each one's own Z offset
+        base = 0.0                # accumulated Z above the last walked node
+        complete = True           # chain ended at a root or a memoized ancestor
         steps = 0
         cur = lp
-        while isinstance(cur, dict) and steps < 64:
+        while isinstance(cur, dict):
+            cached = self._z_cache.get(id(cur))
+            if cached is not None:
+                base = cached
+                break
+            if steps >= 64:
+                complete = False
+                break
             oid = cur.get("id") or cur.get("GlobalId") or cur.get("globalId")
             if oid:
                 soid = str(oid)
                 if soid in seen:
+                    complete = False
                     break
                 seen.add(soid)
 
+            dz = 0.0
             rp = self.deref(first(cur, "RelativePlacement", "relativePlacement"))
             if isinstance(rp, dict):
                 loc = self.deref(first(rp, "Location", "location"))
                 if isinstance(loc, dict):
                     coords = self.coords_from_point(loc)
-                    if coords and len(coords) >= 3 and coords[2] is not None:
-                        z_total += float(coords[2])
+                    if coords:
+                        dz = coords[2]
+            path.append(cur); own.append(dz)
 
             parent = self.deref(first(cur, "PlacementRelTo", "placementRelTo"))
             if parent is None:
@@ -124,7 +178,13 @@ class IfcResolver:
             cur = parent
             steps += 1
 
-        return z_total if steps >= 0 else None
+        # unwind root-side first so every walked placement gets its cumulative Z
+        z_total = base
+        for node, dz in zip(reversed(path), reversed(own)):
+            z_total += dz
+            if complete:
+                self._z_cache[id(node)] = z_total
+        return z_total
 
     def z_from_object_placement(self, obj: Dict) -> Optional[float]:
         op = self.deref(first(obj, "ObjectPlacement", "objectPlacement"))
@@ -132,6 +192,10 @@ class IfcResolver:
             return None
         return self.z_from_local_placement(op)
 
+def read_json(path) -> Any:
+    raw = pathlib.Path(path).read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
 def load_instances(doc: Dict) -> Dict[str, Dict]:
     for k in ("objects","instances"):
         if isinstance(doc.get(k), dict):
@@ -140,93 +204,120 @@ def load_instances(doc: Dict) -> Dict[str, Dict]:
         return doc
     raise ValueError("Unsupported ifcJSON structure")
 
-def build_spatial_index(inst: Dict[str, Dict]) -> Dict[str, List[str]]:
-    children = {}
-    for k, o in inst.items():
+# interned so type checks against these hit the identity fast path
+STOREY_T = sys.intern("IfcBuildingStorey")
+CONTAINED_T = sys.intern("IfcRelContainedInSpatialStructure")
+
+def type_of(o: Dict) -> str:
+    return sys.intern(o.get("type") or o.get("class") or o.get("schema") or "")
+
+def build_type_index(inst: Dict[str, Dict]) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """One pass: guid -> interned IFC type, and IFC type -> guids."""
+    types: Dict[str, str] = {}
+    by_type: Dict[str, List[str]] = {}
+    for g, o in inst.items():
         if not isinstance(o, dict):
             continue
-        t = o.get("type") or o.get("class") or o.get("schema") or ""
-        if t.startswith("IfcRelContainedInSpatialStructure"):
-            rel_str = first(o, "RelatingStructure", "relatingStructure", "RelatingSpatialStructure", "relatingSpatialStructure")
-            rel_el  = first(o, "RelatedElements", "relatedElements")
-            sid = None
-            if isinstance(rel_str, dict):
-                sid = str(rel_str.get("ref") or rel_str.get("$ref") or rel_str.get("id") or rel_str.get("GlobalId") or rel_str.get("globalId"))
-            elif isinstance(rel_str, str):
-                sid = rel_str
-            if not sid:
-                continue
-            arr = []
-            if isinstance(rel_el, list):
-                for e in rel_el:
-                    if isinstance(e, dict):
-                        eid = e.get("ref") or e.get("$ref") or e.get("id") or e.get("GlobalId") or e.get("globalId")
-                        if eid: arr.append(str(eid))
-                    elif isinstance(e, str):
-                        arr.append(e)
-            elif isinstance(rel_el, dict):
-                eid = rel_el.get("ref") or rel_el.get("$ref") or rel_el.get("id") or rel_el.get("GlobalId") or rel_el.get("globalId")
-                if eid: arr.append(str(eid))
-            children.setdefault(sid, []).extend(arr)
+        t = type_of(o)
+        types[g] = t
+        by_type.setdefault(t, []).append(g)
+    return types, by_type
+
+def build_spatial_index(inst: Dict[str, Dict], by_type: Optional[Dict[str, List[str]]] = None) -> Dict[str, List[str]]:
+    if by_type is None:
+        _, by_type = build_type_index(inst)
+    children = {}
+    # only the containment rels are visited, not every instance
+    rel_guids = [g for t, gs in by_type.items() if t.startswith(CONTAINED_T) for g in gs]
+    for k in rel_guids:
+        o = inst[k]
+        rel_str = first(o, "RelatingStructure", "relatingStructure", "RelatingSpatialStructure", "relatingSpatialStructure")
+        rel_el  = first(o, "RelatedElements", "relatedElements")
+        sid = None
+        if isinstance(rel_str, dict):
+            sid = str(rel_str.get("ref") or rel_str.get("$ref") or rel_str.get("id") or rel_str.get("GlobalId") or rel_str.get("globalId"))
+        elif isinstance(rel_str, str):
+            sid = rel_str
+        if not sid:
+            continue
+        arr = []
+        if isinstance(rel_el, list):
+            for e in rel_el:
+                if isinstance(e, dict):
+                    eid = e.get("ref") or e.get("$ref") or e.get("id") or e.get("GlobalId") or e.get("globalId")
+                    if eid: arr.append(str(eid))
+                elif isinstance(e, str):
+                    arr.append(e)
+        elif isinstance(rel_el, dict):
+            eid = rel_el.get("ref") or rel_el.get("$ref") or rel_el.get("id") or rel_el.get("GlobalId") or rel_el.get("globalId")
+            if eid: arr.append(str(eid))
+        children.setdefault(sid, []).extend(arr)
     return children
 
+def write_rows(s, cypher: str, rows: List[Dict]) -> None:
+    """Send rows in BATCH-sized UNWIND writes, one transaction per batch."""
+    for i in range(0, len(rows), BATCH):
+        batch = rows[i:i + BATCH]
+        s.execute_write(lambda tx: tx.run(cypher, rows=batch).consume())
+
+def write_batch(drv, cypher: str, rows: List[Dict]) -> None:
+    # sessions are not thread-safe; each pooled write opens its own
+    with drv.session(database=DB) as s:
+        s.execute_write(lambda tx: tx.run(cypher, rows=rows).consume())
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("paths", nargs="+", help="Paths to ifcJSON files (Arch/Mech)")
     args = ap.parse_args()
 
     drv = GraphDatabase.driver(URI, auth=(USER, PASS))
-    with drv.session(database=DB) as s:
+    with drv.session(database=DB) as s, ThreadPoolExecutor(WRITERS) as pool:
+        s.run(GID_CONSTRAINT_Q).consume()
         for path in args.paths:
-            data = json.loads(pathlib.Path(path).read_text())
+            data = read_json(path)
             inst = load_instances(data)
             res = IfcResolver(inst)
-            spatial = build_spatial_index(inst)
+            types, by_type = build_type_index(inst)
+            spatial = build_spatial_index(inst, by_type)
 
             set_z_nodes = 0
             set_elev_storeys = 0
+            storey_rows: List[Dict] = []
+            z_rows: List[Dict] = []
+            storey_guids: List[str] = []
+            pending = []  # in-flight n.z batches; overlap Bolt round trips with the walk
 
-            # Pass 1: storey elevation from attribute or placement
-            for guid, obj in inst.items():
-                if not isinstance(obj, dict): continue
-                t = obj.get("type") or obj.get("class") or obj.get("schema") or ""
-                if t == "IfcBuildingStorey":
-                    elev_raw = first(obj, "Elevation", "elevation", "ElevationOfRefHeight")
-                    z = as_number(elev_raw)
-                    if z is None:
-                        z = res.z_from_object_placement(obj)
-                    if z is not None:
-                        s.run("MATCH (st:IfcBuildingStorey {globalId:$id}) SET st.elev = $z", id=guid, z=z)
-                        set_elev_storeys += 1
-
-            # Pass 2: per-element Z from placement
-            for guid, obj in inst.items():
-                if not isinstance(obj, dict): continue
+            # Pass 1: Z from placement for every object (one walk each); storeys
+            # also take elev from their attribute, else that same placement Z
+            for guid, t in types.items():
+                obj = inst[guid]
                 z = res.z_from_object_placement(obj)
                 if z is not None:
-                    s.run("MATCH (n {globalId:$id}) SET n.z = $z", id=guid, z=z)
+                    z_rows.append({"id": guid, "z": z})
                     set_z_nodes += 1
-
-            # Pass 3: fill missing storey elev via mean child Z from JSON relations
-            for guid, obj in inst.items():
-                if not isinstance(obj, dict): continue
-                t = obj.get("type") or obj.get("class") or obj.get("schema") or ""
-                if t == "IfcBuildingStorey":
-                    rec = s.run("MATCH (st:IfcBuildingStorey {globalId:$id}) RETURN st.elev AS e", id=guid).single()
-                    if rec and rec["e"] is not None:
-                        continue
-                    kid_ids = spatial.get(guid, [])
-                    if not kid_ids:
-                        continue
-                    avg = s.run("""
-                        UNWIND $ids AS id
-                        MATCH (n {globalId:id})
-                        WHERE n.z IS NOT NULL
-                        RETURN avg(n.z) AS av
-                    """, ids=kid_ids).single()["av"]
-                    if avg is not None:
-                        s.run("MATCH (st:IfcBuildingStorey {globalId:$id}) SET st.elev = $z", id=guid, z=float(avg))
+                    if len(z_rows) >= BATCH:
+                        pending.append(pool.submit(write_batch, drv, NODE_Z_Q, z_rows))
+                        z_rows = []
+                if t == STOREY_T:
+                    storey_guids.append(guid)
+                    elev = as_number(first(obj, "Elevation", "elevation", "ElevationOfRefHeight"))
+                    if elev is None:
+                        elev = z
+                    if elev is not None:
+                        storey_rows.append({"id": guid, "z": elev})
                         set_elev_storeys += 1
+            if z_rows:
+                pending.append(pool.submit(write_batch, drv, NODE_Z_Q, z_rows))
+            write_rows(s, STOREY_ELEV_Q, storey_rows)
+            for f in pending:
+                f.result()  # all n.z must land before the storey fill averages it
+
+            # Pass 2: fill missing storey elev via mean child Z from JSON relations
+            # (one aggregation; the elev IS NULL guard keeps elevs set above)
+            pairs = [{"sid": guid, "kids": spatial[guid]} for guid in storey_guids if spatial.get(guid)]
+            if pairs:
+                rec = s.execute_write(lambda tx: tx.run(STOREY_FILL_Q, pairs=pairs).single())
+                set_elev_storeys += rec["c"] if rec else 0
 
             print(f"✅ {path}: set z on {set_z_nodes} nodes; set elev on {set_elev_storeys} storeys")
 
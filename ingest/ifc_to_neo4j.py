@@ -1,6 +1,8 @@
 # ingest/ifc_to_neo4j.py
 import os, json, argparse, pathlib
-from typing import Any, Dict, Optional, List
+from collections import defaultdict
+from itertools import chain
+from typing import Any, Dict, Optional, List, Tuple
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 
@@ -10,6 +12,47 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+# Unique globalId on :IfcEntity backs every MATCH/MERGE-by-globalId with an index seek
+GID_CONSTRAINT_Q = "CREATE CONSTRAINT ifcentity_gid IF NOT EXISTS FOR (n:IfcEntity) REQUIRE n.globalId IS UNIQUE"
+
+BATCH = 5000  # rows per UNWIND write
+
+# One statement per (IFC type, CMMS label) pair so the query text, and its cached
+# plan, is constant per label-set; z is always sent and coalesced.
+NODE_MERGE_Q = """
+UNWIND $rows AS r
+MERGE (n:IfcEntity {{globalId:r.id}})
+ON CREATE SET n.name=r.name, n.type=r.type, n.source=r.src
+ON MATCH  SET n.type=r.type,  n.source=coalesce(n.source,r.src)
+SET n:{t}:{label}, n.z = coalesce(r.z, n.z)
+"""
+
+SYSTEM_MERGE_Q = """
+UNWIND $rows AS r
+MERGE (sys:IfcEntity {globalId:r.id})
+ON CREATE SET sys.name=r.name, sys.type='IfcSystem', sys.source=r.src
+SET sys:IfcSystem
+"""
+
+# reltype comes from the fixed set written in main(), never from file content.
+# Edge lists can run to 100k+ rows, so the server commits them in sub-transactions.
+REL_MERGE_Q = """
+UNWIND $rows AS r
+CALL {{
+    WITH r
+    MATCH (a:IfcEntity {{globalId:r.a}}),(b:IfcEntity {{globalId:r.b}})
+    MERGE (a)-[:{rel}]->(b)
+}} IN TRANSACTIONS OF 10000 ROWS
+"""
+SHIP = 100000  # rows per auto-commit call for IN TRANSACTIONS writes
+
+PSETS_Q = """
+UNWIND $rows AS r
+MATCH (n:IfcEntity {globalId:r.id})
+SET n.psets_json = coalesce(n.psets_json, r.pjson)
+SET n += r.flat
+"""
+
 # --- IFC ---
 import ifcopenshell
 from ifcopenshell.util.element import get_psets
@@ -29,20 +72,36 @@ def name_of(o) -> str:
         return n.strip() if isinstance(n, str) else str(n)
     except: return ""
 
+# STEP id -> Z summed from that placement up to the root (one file per run)
+_Z_CACHE: Dict[int, float] = {}
+
 def z_from_local_placement(lp) -> Optional[float]:
     """Sum Z translation up the IfcLocalPlacement → PlacementRelTo chain (ignores rotation)."""
+    path: List[int] = []
+    own: List[float] = []
     z = 0.0
     steps = 0
     cur = lp
     try:
         while cur and steps < 64:
+            key = cur.id()
+            if key in _Z_CACHE:
+                z = _Z_CACHE[key]
+                break
+            dz = 0.0
             rp = getattr(cur, "RelativePlacement", None)
             if rp and getattr(rp, "Location", None):
                 coords = rp.Location.Coordinates
                 if coords and len(coords) >= 3 and coords[2] is not None:
-                    z += float(coords[2])
+                    dz = float(coords[2])
+            path.append(key); own.append(dz)
             cur = getattr(cur, "PlacementRelTo", None)
             steps += 1
+        complete = steps < 64
+        for key, dz in zip(reversed(path), reversed(own)):
+            z += dz
+            if complete:
+                _Z_CACHE[key] = z
         return z
     except Exception:
         return None
@@ -75,6 +134,17 @@ def flatten_psets(ps: Dict[str, Any]) -> Dict[str, Any]:
                     out[key] = s if isinstance(s, (str, int, float, bool)) else str(v)
     return out
 
+def write_rows(s, cypher: str, rows: List[Dict]) -> None:
+    """Send rows in BATCH-sized UNWIND writes, one transaction per batch."""
+    for i in range(0, len(rows), BATCH):
+        batch = rows[i:i + BATCH]
+        s.execute_write(lambda tx: tx.run(cypher, rows=batch).consume())
+
+def write_rows_in_tx(s, cypher: str, rows: List[Dict]) -> None:
+    """For CALL {} IN TRANSACTIONS statements, which need an auto-commit transaction."""
+    for i in range(0, len(rows), SHIP):
+        s.run(cypher, rows=rows[i:i + SHIP]).consume()
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("path", help="Path to .ifc (SPF)")
@@ -86,11 +156,11 @@ def main():
 
     drv = GraphDatabase.driver(URI, auth=(USER, PASS))
     with drv.session(database=DB) as s:
+        s.run(GID_CONSTRAINT_Q).consume()
 
         # --- 1) Upsert nodes (only properties we truly need; you already have nodes from JSON)
         # Building storeys (set elevation)
-        storeys = ifc.by_type("IfcBuildingStorey")
-        for st in storeys:
+        for st in ifc.by_type("IfcBuildingStorey"):
             gid = st.GlobalId
             elev = getattr(st, "Elevation", None)
             s.run("""
@@ -100,37 +170,46 @@ def main():
             """, id=gid, name=name_of(st), src=SOURCE, elev=float(elev) if elev is not None else None)
 
         # Any element with a placement → set z
-        elems = ifc.by_type("IfcElement") + ifc.by_type("IfcDistributionElement") + ifc.by_type("IfcSystem")
+        stmts: Dict[Tuple[str, str], str] = {}
+        node_rows: Dict[Tuple[str, str], List[Dict]] = defaultdict(list)
+        pset_rows: List[Dict] = []
+
+        def flush_elems():
+            # nodes first so the pset MATCHes find them
+            for key, rows in node_rows.items():
+                write_rows(s, stmts[key], rows)
+            node_rows.clear()
+            write_rows(s, PSETS_Q, pset_rows)
+            pset_rows.clear()
+
+        pending = 0
+        elems = chain(ifc.by_type("IfcElement"), ifc.by_type("IfcDistributionElement"), ifc.by_type("IfcSystem"))
         for e in elems:
             gid = getattr(e, "GlobalId", None)
             if not gid: continue
             t   = ifc_type(e)
-            nm  = name_of(e)
-            z   = z_of(e)
+            key = (t, cmms_label(t))
+            if key not in stmts:
+                stmts[key] = NODE_MERGE_Q.format(t=key[0], label=key[1])
             # merge labels by type; do not clobber existing JSON props
-            s.run(f"""
-                MERGE (n:IfcEntity:{t}:{cmms_label(t)} {{globalId:$id}})
-                ON CREATE SET n.name=$name, n.type=$type, n.source=$src
-                ON MATCH  SET n.type=$type,  n.source=coalesce(n.source,$src)
-                {"SET n.z = $z" if z is not None else ""}
-            """, id=gid, name=nm, type=t, src=SOURCE, z=z)
+            node_rows[key].append({"id": gid, "name": name_of(e), "type": t, "src": SOURCE, "z": z_of(e)})
+            pending += 1
 
             # Psets (nice to have; you already added many via JSON)
             try:
                 ps = get_psets(e) or {}
                 if ps:
-                    flat = flatten_psets(ps)
-                    s.run("""
-                        MATCH (n {globalId:$id})
-                        SET n.psets_json = coalesce(n.psets_json, $psets_json)
-                        SET n += $flat
-                    """, id=gid, psets_json=json.dumps(ps, ensure_ascii=False), flat=flat)
+                    pset_rows.append({"id": gid, "flat": flatten_psets(ps),
+                                      "pjson": json.dumps(ps, ensure_ascii=False)})
             except Exception:
                 pass
-        
+            if pending >= BATCH:
+                flush_elems()
+                pending = 0
+        flush_elems()
+
         # --- SPACES (rooms) ---
-        spaces = ifc.by_type("IfcSpace")
-        for sp in spaces:
+        for sp in ifc.by_type("IfcSpace"):
             gid  = getattr(sp, "GlobalId", None)
             if not gid:
                 continue
@@ -151,14 +230,12 @@ def main():
             """, id=gid, name=nm, src=SOURCE, long=long)
 
             if flat or pjson:
-                s.run("""
-                    MATCH (x:IfcSpace {globalId:$id})
-                    SET x.psets_json = coalesce(x.psets_json, $pjson)
-                    SET x += $flat
-                """, id=gid, pjson=pjson, flat=flat)
-
+                pset_rows.append({"id": gid, "flat": flat, "pjson": pjson})
+        write_rows(s, PSETS_Q, pset_rows)
 
         # --- 2) Relationships (spatial, aggregates, systems, connectivity)
+        rels: Dict[str, List[Dict]] = defaultdict(list)
+
         # Spatial containment
         for rel in ifc.by_type("IfcRelContainedInSpatialStructure"):
             parent = getattr(rel.RelatingStructure, "GlobalId", None)
@@ -166,7 +243,7 @@ def main():
             for child in getattr(rel, "RelatedElements", []) or []:
                 gid = getattr(child, "GlobalId", None)
                 if not gid: continue
-                s.run("MATCH (a {globalId:$a}),(b {globalId:$b}) MERGE (a)-[:CONTAINS]->(b)", a=parent, b=gid)
+                rels["CONTAINS"].append({"a": parent, "b": gid})
 
         # Aggregation
         for rel in ifc.by_type("IfcRelAggregates"):
@@ -174,22 +251,20 @@ def main():
             for part in getattr(rel, "RelatedObjects", []) or []:
                 pid = getattr(part, "GlobalId", None)
                 if whole and pid:
-                    s.run("MATCH (a {globalId:$a}),(b {globalId:$b}) MERGE (a)-[:AGGREGATES]->(b)", a=whole, b=pid)
+                    rels["AGGREGATES"].append({"a": whole, "b": pid})
 
         # Systems (AssignsToGroup)
+        system_rows: List[Dict] = []
         for rel in ifc.by_type("IfcRelAssignsToGroup"):
             grp = getattr(rel, "RelatingGroup", None)
             gid = getattr(grp, "GlobalId", None) if grp else None
             if not gid: continue
             # ensure system node exists
-            s.run("""
-                MERGE (sys:IfcEntity:IfcSystem {globalId:$id})
-                ON CREATE SET sys.name=$name, sys.type='IfcSystem', sys.source=$src
-            """, id=gid, name=name_of(grp), src=SOURCE)
+            system_rows.append({"id": gid, "name": name_of(grp), "src": SOURCE})
             for o in getattr(rel, "RelatedObjects", []) or []:
                 oid = getattr(o, "GlobalId", None)
                 if oid:
-                    s.run("MATCH (e {globalId:$e}),(sys {globalId:$s}) MERGE (e)-[:ASSIGNED_TO_SYSTEM]->(sys)", e=oid, s=gid)
+                    rels["ASSIGNED_TO_SYSTEM"].append({"a": oid, "b": gid})
 
         # Ports connectivity (if present)
         for rel in ifc.by_type("IfcRelConnectsPortToElement"):
@@ -198,7 +273,7 @@ def main():
             pid  = getattr(port, "GlobalId", None) if port else None
             eid  = getattr(elem, "GlobalId", None) if elem else None
             if pid and eid:
-                s.run("MATCH (e {globalId:$e}),(p {globalId:$p}) MERGE (e)-[:HAS_PORT]->(p)", e=eid, p=pid)
+                rels["HAS_PORT"].append({"a": eid, "b": pid})
 
         for rel in ifc.by_type("IfcRelConnectsPorts"):
             p1 = getattr(rel, "RelatingPort", None)
@@ -206,8 +281,7 @@ def main():
             a  = getattr(p1, "GlobalId", None) if p1 else None
             b  = getattr(p2, "GlobalId", None) if p2 else None
             if a and b:
-                s.run("MATCH (a {globalId:$a}),(b {globalId:$b}) MERGE (a)-[:PORT_CONNECTED_TO]->(b)", a=a, b=b)
-                s.run("MATCH (a {globalId:$a}),(b {globalId:$b}) MERGE (b)-[:PORT_CONNECTED_TO]->(a)", a=a, b=b)
+                rels["PORT_CONNECTED_TO"] += [{"a": a, "b": b}, {"a": b, "b": a}]
 
         # Element-level connectivity (loose)
         for rel in ifc.by_type("IfcRelConnectsElements"):
@@ -216,8 +290,11 @@ def main():
             ga = getattr(a, "GlobalId", None) if a else None
             gb = getattr(b, "GlobalId", None) if b else None
             if ga and gb:
-                s.run("MATCH (a {globalId:$a}),(b {globalId:$b}) MERGE (a)-[:CONNECTED_TO]->(b)", a=ga, b=gb)
-                s.run("MATCH (a {globalId:$a}),(b {globalId:$b}) MERGE (b)-[:CONNECTED_TO]->(a)", a=ga, b=gb)
+                rels["CONNECTED_TO"] += [{"a": ga, "b": gb}, {"a": gb, "b": ga}]
+
+        write_rows(s, SYSTEM_MERGE_Q, system_rows)
+        for reltype, rows in rels.items():
+            write_rows_in_tx(s, REL_MERGE_Q.format(rel=reltype), rows)
 
     drv.close()
     print("✅ IFC ingest complete for", args.path)
@@ -1,8 +1,13 @@
 # ingest/ifcjson_edges.py
 import os, json, pathlib, argparse
+from collections import defaultdict
 from typing import Any, Dict, List, Optional
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
+try:
+    import orjson  # faster parse straight from bytes
+except ImportError:
+    orjson = None
 
 load_dotenv()
 URI  = os.getenv("NEO4J_URI", "bolt://localhost:7687")
@@ -10,6 +15,12 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+BATCH = 5000  # edges per UNWIND write
+# reltypes are interpolated into Cypher, so only these are ever sent
+REL_TYPES = {"CONTAINS", "AGGREGATES", "SERVICES", "ASSIGNED_TO_SYSTEM",
+             "HAS_PORT", "PORT_CONNECTED_TO", "CONNECTED_TO"}
+GID_CONSTRAINT_Q = "CREATE CONSTRAINT ifcentity_gid IF NOT EXISTS FOR (n:IfcEntity) REQUIRE n.globalId IS UNIQUE"
+
 def ref_id(x: Any) -> Optional[str]:
     if x is None: return None
     if isinstance(x, str): return x
@@ -28,6 +39,10 @@ def g(obj: Dict, *keys: str):
         if k in attrs: return attrs[k]
     return None
 
+def read_json(path) -> Any:
+    raw = pathlib.Path(path).read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
 def load_instances(data: Dict) -> Dict[str, Dict]:
     for k in ("objects","instances"):
         if isinstance(data.get(k), dict):
@@ -36,8 +51,11 @@ def load_instances(data: Dict) -> Dict[str, Dict]:
         return data
     raise ValueError("Unsupported ifcJSON structure")
 
-def merge_rel(tx, a, b, reltype):
-    tx.run(f"MATCH (a {{globalId:$a}}),(b {{globalId:$b}}) MERGE (a)-[:{reltype}]->(b)", a=a, b=b)
+def merge_rels(tx, reltype: str, rows: List[Dict]):
+    if reltype not in REL_TYPES:
+        raise ValueError(f"Unsupported relationship type: {reltype}")
+    tx.run(f"UNWIND $rows AS r MATCH (a:IfcEntity {{globalId:r.a}}),(b:IfcEntity {{globalId:r.b}}) MERGE (a)-[:{reltype}]->(b)",
+           rows=rows).consume()
 
 def main():
     ap = argparse.ArgumentParser()
@@ -45,86 +63,90 @@ def main():
     args = ap.parse_args()
 
     path = pathlib.Path(args.path)
-    data = json.loads(path.read_text())
+    data = read_json(path)
     inst = load_instances(data)
 
+    buckets: Dict[str, List[Dict]] = defaultdict(list)
+    for guid, obj in inst.items():
+        if not isinstance(obj, dict):
+            continue
+        t = obj.get("type") or obj.get("class") or obj.get("schema") or ""
+        if not t.startswith("IfcRel"):
+            continue
+
+        # ----- Spatial containment
+        if t in ("IfcRelContainedInSpatialStructure", "IfcRelContainedInSpatialStructure_"):
+            rs = g(obj, "RelatingStructure", "relatingStructure", "RelatingSpatialStructure", "relatingSpatialStructure")
+            re = g(obj, "RelatedElements", "relatedElements")
+            parent = ref_id(rs)
+            kids = re if isinstance(re, list) else [re] if re else []
+            for k in kids:
+                child = ref_id(k)
+                if parent and child:
+                    buckets["CONTAINS"].append({"a": parent, "b": child})
+
+        # ----- Aggregation (decomposition)
+        elif t == "IfcRelAggregates":
+            whole = g(obj, "RelatingObject", "relatingObject")
+            parts = g(obj, "RelatedObjects", "relatedObjects")
+            whole_id = ref_id(whole)
+            kids = parts if isinstance(parts, list) else [parts] if parts else []
+            for k in kids:
+                part_id = ref_id(k)
+                if whole_id and part_id:
+                    buckets["AGGREGATES"].append({"a": whole_id, "b": part_id})
+
+        # ----- System servicing a building
+        elif t == "IfcRelServicesBuildings":
+            sysref = g(obj, "RelatingSystem", "relatingSystem")
+            blds  = g(obj, "RelatedBuildings", "relatedBuildings")
+            sid = ref_id(sysref)
+            bs = blds if isinstance(blds, list) else [blds] if blds else []
+            for b in bs:
+                bid = ref_id(b)
+                if sid and bid:
+                    buckets["SERVICES"].append({"a": sid, "b": bid})
+
+        # ----- Assign elements to a group (system)
+        elif t == "IfcRelAssignsToGroup":
+            grp = g(obj, "RelatingGroup", "relatingGroup")
+            objs = g(obj, "RelatedObjects", "relatedObjects")
+            gid = ref_id(grp)
+            os = objs if isinstance(objs, list) else [objs] if objs else []
+            for o in os:
+                oid = ref_id(o)
+                if gid and oid:
+                    # element -> system
+                    buckets["ASSIGNED_TO_SYSTEM"].append({"a": oid, "b": gid})
+
+        # ----- Connectivity fallbacks (ports / elements)
+        elif t in ("IfcRelConnectsPortToElement", "IfcRelConnectsPortToElement_"):
+            port = ref_id(g(obj, "RelatingPort", "relatingPort"))
+            elem = ref_id(g(obj, "RelatedElement", "relatedElement"))
+            if port and elem:
+                buckets["HAS_PORT"].append({"a": elem, "b": port})
+
+        elif t in ("IfcRelConnectsPorts", "IfcRelConnectsPorts_"):
+            p1 = ref_id(g(obj, "RelatingPort", "relatingPort"))
+            p2 = ref_id(g(obj, "RelatedPort", "relatedPort"))
+            if p1 and p2:
+                buckets["PORT_CONNECTED_TO"] += [{"a": p1, "b": p2}, {"a": p2, "b": p1}]
+
+        elif t in ("IfcRelConnectsElements", "IfcRelConnectsElements_"):
+            a = ref_id(g(obj, "RelatingElement", "relatingElement"))
+            b = ref_id(g(obj, "RelatedElement", "relatedElement"))
+            if a and b:
+                buckets["CONNECTED_TO"] += [{"a": a, "b": b}, {"a": b, "b": a}]
+
     drv = GraphDatabase.driver(URI, auth=(USER, PASS))
     created = 0
     with drv.session(database=DB) as s:
-        for guid, obj in inst.items():
-            if not isinstance(obj, dict):
-                continue
-            t = obj.get("type") or obj.get("class") or obj.get("schema") or ""
-            if not t.startswith("IfcRel"):
-                continue
-
-            # ----- Spatial containment
-            if t in ("IfcRelContainedInSpatialStructure", "IfcRelContainedInSpatialStructure_"):
-                rs = g(obj, "RelatingStructure", "relatingStructure", "RelatingSpatialStructure", "relatingSpatialStructure")
-                re = g(obj, "RelatedElements", "relatedElements")
-                parent = ref_id(rs)
-                kids = re if isinstance(re, list) else [re] if re else []
-                for k in kids:
-                    child = ref_id(k)
-                    if parent and child:
-                        s.write_transaction(merge_rel, parent, child, "CONTAINS"); created += 1
-
-            # ----- Aggregation (decomposition)
-            elif t == "IfcRelAggregates":
-                whole = g(obj, "RelatingObject", "relatingObject")
-                parts = g(obj, "RelatedObjects", "relatedObjects")
-                whole_id = ref_id(whole)
-                kids = parts if isinstance(parts, list) else [parts] if parts else []
-                for k in kids:
-                    part_id = ref_id(k)
-                    if whole_id and part_id:
-                        s.write_transaction(merge_rel, whole_id, part_id, "AGGREGATES"); created += 1
-
-            # ----- System servicing a building
-            elif t == "IfcRelServicesBuildings":
-                sysref = g(obj, "RelatingSystem", "relatingSystem")
-                blds  = g(obj, "RelatedBuildings", "relatedBuildings")
-                sid = ref_id(sysref)
-                bs = blds if isinstance(blds, list) else [blds] if blds else []
-                for b in bs:
-                    bid = ref_id(b)
-                    if sid and bid:
-                        s.write_transaction(merge_rel, sid, bid, "SERVICES"); created += 1
-
-            # ----- Assign elements to a group (system)
-            elif t == "IfcRelAssignsToGroup":
-                grp = g(obj, "RelatingGroup", "relatingGroup")
-                objs = g(obj, "RelatedObjects", "relatedObjects")
-                gid = ref_id(grp)
-                os = objs if isinstance(objs, list) else [objs] if objs else []
-                for o in os:
-                    oid = ref_id(o)
-                    if gid and oid:
-                        # element -> system
-                        s.write_transaction(merge_rel, oid, gid, "ASSIGNED_TO_SYSTEM"); created += 1
-
-            # ----- Connectivity fallbacks (ports / elements)
-            elif t in ("IfcRelConnectsPortToElement", "IfcRelConnectsPortToElement_"):
-                port = ref_id(g(obj, "RelatingPort", "relatingPort"))
-                elem = ref_id(g(obj, "RelatedElement", "relatedElement"))
-                if port and elem:
-                    s.write_transaction(merge_rel, elem, port, "HAS_PORT"); created += 1
-
-            elif t in ("IfcRelConnectsPorts", "IfcRelConnectsPorts_"):
-                p1 = ref_id(g(obj, "RelatingPort", "relatingPort"))
-                p2 = ref_id(g(obj, "RelatedPort", "relatedPort"))
-                if p1 and p2:
-                    s.write_transaction(merge_rel, p1, p2, "PORT_CONNECTED_TO")
-                    s.write_transaction(merge_rel, p2, p1, "PORT_CONNECTED_TO")
-                    created += 2
-
-            elif t in ("IfcRelConnectsElements", "IfcRelConnectsElements_"):
-                a = ref_id(g(obj, "RelatingElement", "relatingElement"))
-                b = ref_id(g(obj, "RelatedElement", "relatedElement"))
-                if a and b:
-                    s.write_transaction(merge_rel, a, b, "CONNECTED_TO")
-                    s.write_transaction(merge_rel, b, a, "CONNECTED_TO")
-                    created += 2
+        s.run(GID_CONSTRAINT_Q).consume()
+        for rel, rows in buckets.items():
+            for i in range(0, len(rows), BATCH):
+                chunk = rows[i:i + BATCH]
+                s.execute_write(merge_rels, rel, chunk)
+                created += len(chunk)
 
     drv.close()
     print(f"✅ Edges merged: {created}")
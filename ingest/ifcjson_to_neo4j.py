@@ -1,9 +1,20 @@
 # ingest/ifcjson_to_neo4j.py
 import os, sys, json, pathlib
 import argparse
-from typing import Any, Dict, Iterable, List, Optional
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
+try:
+    import orjson  # faster parse straight from bytes
+except ImportError:
+    orjson = None
+try:
+    import ijson  # streams (guid, obj) pairs without holding the whole model
+except ImportError:
+    ijson = None
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,18 +25,69 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+# Rows per UNWIND write
+BATCH = 1000
+LABEL_BATCH = 5000  # addLabels rows are tiny (one id each), so larger chunks
+WORKERS = int(os.getenv("NEO4J_FILE_WORKERS", "8"))  # files ingested in parallel
+# Unique globalId on :IfcEntity turns every MERGE/MATCH by globalId into an index seek
+GID_CONSTRAINT_Q = "CREATE CONSTRAINT ifcentity_gid IF NOT EXISTS FOR (n:IfcEntity) REQUIRE n.globalId IS UNIQUE"
+# Lucene name/reference indexes for the RAG lexical seeds (same DDL as graph/schema.cypher)
+NAME_FT_Q = "CREATE FULLTEXT INDEX ifcName IF NOT EXISTS FOR (n:IfcEntity) ON EACH [n.name]"
+REF_FT_Q = "CREATE FULLTEXT INDEX ifcReference IF NOT EXISTS FOR (n:IfcEntity) ON EACH [n.reference]"
+# promoted to n.reference so lexical seeds don't parse psets_json per node
+REF_PSET_KEY = "Pset_BuildingElementProxyCommon.Reference"
+
+# Pass 1 node upsert, one row per GUID; psets/attrs travel as maps, JSON-encoded server-side
+NODE_MERGE_Q = """
+UNWIND $rows AS r
+MERGE (n:IfcEntity {globalId:r.id})
+ON CREATE SET
+    n.name = r.name,
+    n.type = r.ifc_type,
+    n.source = $source,
+    n.psets_json = apoc.convert.toJson(r.psets),
+    n.attrs_json = apoc.convert.toJson(r.attrs),
+    n.flowDirection = coalesce(r.flow_dir, n.flowDirection),
+    n.reference = toString(r.reference)
+ON MATCH SET
+    n.name = coalesce(n.name, r.name),
+    n.type = r.ifc_type,
+    n.source = coalesce(n.source, $source),
+    n.psets_json = coalesce(n.psets_json, apoc.convert.toJson(r.psets)),
+    n.attrs_json = coalesce(n.attrs_json, apoc.convert.toJson(r.attrs)),
+    n.flowDirection = coalesce(n.flowDirection, r.flow_dir),
+    n.reference = coalesce(n.reference, toString(r.reference))
+SET n += r.props_flat
+"""
+
+# Pass 2 edge upsert; {rel} is always one of the literal names bucketed in main()
+REL_MERGE_Q = """
+UNWIND $rows AS r
+MATCH (a:IfcEntity {{globalId:r.a}}), (b:IfcEntity {{globalId:r.b}})
+MERGE (a)-[:{rel}]->(b)
+"""
+
+# Add labels AFTER merge (safe even if they already exist); one call per label-set
+ADD_LABELS_Q = """
+UNWIND $ids AS id
+MATCH (n:IfcEntity {globalId:id})
+CALL apoc.create.addLabels(n, $labels) YIELD node
+RETURN count(node) AS c
+"""
+
 # Spatial types
 SPATIAL_TYPES = {
     "IfcProject","IfcSite","IfcBuilding","IfcBuildingStorey","IfcSpace"
 }
 
-# Super-simple helper to map IFC type → a coarse CMMS-ish class
+# Super-simple helper to map IFC type → a coarse CMMS-ish class (few distinct types, so cached)
+@lru_cache(maxsize=None)
 def cmms_label(ifc_type: str) -> str:
     if ifc_type in SPATIAL_TYPES:
         return ifc_type
     if ifc_type.startswith("IfcSystem"):
         return "IfcSystem"
-    if ifc_type.startswith("IfcFlow") or ifc_type.startswith("IfcDistribution"):
+    if ifc_type.startswith(("IfcFlow", "IfcDistribution")):
         return "IfcDistributionElement"
     if ifc_type.startswith("IfcElement"):
         return "IfcElement"
@@ -140,6 +202,85 @@ def select_flat_props(ps: dict) -> dict:
             out[sk] = ps.get(k)
     return out
 
+# Pass 2 handlers: one per IfcRel* type, each fetching only the fields it needs
+Buckets = Dict[str, List[Dict[str, str]]]
+
+def _handle_contained(obj: Dict, buckets: Buckets) -> None:
+    rs = obj.get("RelatingStructure") or obj.get("relatingStructure")
+    re = obj.get("RelatedElements") or obj.get("relatedElements")
+    if not (rs and re):
+        return
+    parent = ref_id(rs)
+    for k in (re if isinstance(re, list) else [re]):
+        child = ref_id(k)
+        if parent and child:
+            # (Spatial) -[:CONTAINS]-> (Element)
+            buckets["CONTAINS"].append({"a": parent, "b": child})
+
+def _handle_aggregates(obj: Dict, buckets: Buckets) -> None:
+    rso = obj.get("RelatingObject") or obj.get("relatingObject")
+    ro = obj.get("RelatedObjects") or obj.get("relatedObjects")
+    if not (rso and ro):
+        return
+    parent = ref_id(rso)
+    for k in (ro if isinstance(ro, list) else [ro]):
+        child = ref_id(k)
+        if parent and child:
+            buckets["AGGREGATES"].append({"a": parent, "b": child})
+
+def _handle_services(obj: Dict, buckets: Buckets) -> None:
+    rb = obj.get("RelatedBuildings") or obj.get("relatedBuildings")
+    if not rb:
+        return
+    sys_ref = ref_id(obj.get("RelatingSystem") or obj.get("relatingSystem"))
+    for b in (rb if isinstance(rb, list) else [rb]):
+        bld = ref_id(b)
+        if sys_ref and bld:
+            buckets["SERVICES"].append({"a": sys_ref, "b": bld})
+
+def _handle_assigns_to_group(obj: Dict, buckets: Buckets) -> None:
+    rg = obj.get("RelatingGroup") or obj.get("relatingGroup")
+    ro = obj.get("RelatedObjects") or obj.get("relatedObjects")
+    if not (rg and ro):
+        return
+    sys_ref = ref_id(rg)
+    for o in (ro if isinstance(ro, list) else [ro]):
+        el = ref_id(o)
+        if sys_ref and el:
+            # (Element)-[:ASSIGNED_TO_SYSTEM]->(System)
+            buckets["ASSIGNED_TO_SYSTEM"].append({"a": el, "b": sys_ref})
+
+def _handle_port_to_element(obj: Dict, buckets: Buckets) -> None:
+    # Port attached to Element
+    port = ref_id(obj.get("RelatingPort") or obj.get("relatingPort"))
+    elem = ref_id(obj.get("RelatedElement") or obj.get("relatedElement"))
+    if port and elem:
+        buckets["HAS_PORT"].append({"a": elem, "b": port})
+
+def _handle_ports(obj: Dict, buckets: Buckets) -> None:
+    # Port connected to Port
+    pa = ref_id(obj.get("RelatingPort") or obj.get("relatingPort"))
+    pb = ref_id(obj.get("RelatedPort") or obj.get("relatedPort"))
+    if pa and pb:
+        buckets["PORT_CONNECTED_TO"].append({"a": pa, "b": pb})
+
+def _handle_elements(obj: Dict, buckets: Buckets) -> None:
+    # Element connected to Element
+    a = ref_id(obj.get("RelatingElement") or obj.get("relatingElement"))
+    b = ref_id(obj.get("RelatedElement") or obj.get("relatedElement"))
+    if a and b:
+        buckets["CONNECTED_TO"].append({"a": a, "b": b})
+
+REL_HANDLERS: Dict[str, Callable[[Dict, Buckets], None]] = {
+    "IfcRelContainedInSpatialStructure": _handle_contained,
+    "IfcRelAggregates": _handle_aggregates,
+    "IfcRelServicesBuildings": _handle_services,
+    "IfcRelAssignsToGroup": _handle_assigns_to_group,
+    "IfcRelConnectsPortToElement": _handle_port_to_element,
+    "IfcRelConnectsPorts": _handle_ports,
+    "IfcRelConnectsElements": _handle_elements,
+}
+
 # Helper function to load instances from ifcJSON
 def load_instances(data: Dict) -> Dict[str, Dict]:
     # ifcJSON variants:
@@ -154,196 +295,201 @@ def load_instances(data: Dict) -> Dict[str, Dict]:
         return data  # flat GUID -> obj map
     raise ValueError("Unsupported ifcJSON structure; expected 'objects' or 'instances' mapping")
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("path", help="Path to ifcJSON file")
-    parser.add_argument("--source", default=None, help="Logical source tag, e.g., Arch/Mech")
-    args = parser.parse_args()
+def read_json(path: pathlib.Path) -> Any:
+    raw = path.read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
 
-    path = pathlib.Path(args.path)
-    source = args.source or path.stem
+def _instances_prefix(path: pathlib.Path) -> str:
+    # Walk the top-level keys (nested values are skipped by depth, never built): "objects"/
+    # "instances" as soon as one holds a map, so a leading {"schema": "IFC2X3", ...} is fine;
+    # "" for a flat GUID -> obj file, which needs every top-level value to be a map
+    flat = True
+    with open(path, "rb") as f:
+        events = ijson.basic_parse(f)
+        if next(events, (None, None))[0] != "start_map":
+            raise ValueError("Unsupported ifcJSON structure; expected 'objects' or 'instances' mapping")
+        key, depth = None, 0
+        for event, value in events:
+            if depth:
+                if event in ("start_map", "start_array"):
+                    depth += 1
+                elif event in ("end_map", "end_array"):
+                    depth -= 1
+            elif event == "map_key":
+                key = value
+            elif event == "start_map":
+                if key in ("objects", "instances"):
+                    return key
+                depth = 1
+            elif event == "end_map":
+                break
+            else:
+                flat = False  # scalar or array value: not a flat map, keep looking for the wrapper
+                if event == "start_array":
+                    depth = 1
+    if not flat:
+        raise ValueError("Unsupported ifcJSON structure; expected 'objects' or 'instances' mapping")
+    return ""
 
-    data = json.loads(path.read_text())
-    inst = load_instances(data)
+def iter_instances(path: pathlib.Path) -> Iterable[Tuple[str, Any]]:
+    """Stream (guid, obj) pairs from an ifcJSON file with ijson."""
+    prefix = _instances_prefix(path)
+    with open(path, "rb") as f:
+        # use_float: Decimal values would not survive the Bolt packer
+        yield from ijson.kvitems(f, prefix, use_float=True)
 
-    driver = GraphDatabase.driver(URI, auth=(USER, PASS))
+def iter_jsonl(path: pathlib.Path) -> Iterable[Tuple[str, Any]]:
+    """(guid, obj) pairs from a line-per-instance {"id": guid, ...} file."""
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                obj = loads(line)
+                yield obj.pop("id"), obj
+
+def write_tx(s, cypher: str, **params) -> None:
+    """Run one write statement in its own managed (retryable) transaction."""
+    s.execute_write(lambda tx: tx.run(cypher, **params).consume())
+
+# Element connected to Element via ports
+PORT_CONNECTED_Q = """
+MATCH (e1)-[:HAS_PORT]->(p1:IfcDistributionPort)-[:PORT_CONNECTED_TO]->(p2:IfcDistributionPort)<-[:HAS_PORT]-(e2)
+MERGE (e1)-[:CONNECTED_TO]->(e2)
+"""
+# Directed FEEDS when port directions are available
+PORT_FEEDS_Q = """
+MATCH (src)-[:HAS_PORT]->(p:IfcDistributionPort)-[:PORT_CONNECTED_TO]->(q:IfcDistributionPort)<-[:HAS_PORT]-(dst)
+WHERE toUpper(coalesce(p.flowDirection,'')) CONTAINS 'SOURCE'
+AND toUpper(coalesce(q.flowDirection,'')) CONTAINS 'SINK'
+MERGE (src)-[:FEEDS]->(dst)
+"""
+
+def open_instances(path: pathlib.Path) -> Iterable[Tuple[str, Any]]:
+    """(guid, obj) pairs from a .jsonl file, or an ifcJSON file (streamed with ijson when installed)."""
+    if path.suffix == ".jsonl":
+        return iter_jsonl(path)
+    return iter_instances(path) if ijson else load_instances(read_json(path)).items()
+
+def scan_guids(path: pathlib.Path) -> Set[str]:
+    return {guid for guid, obj in open_instances(path) if isinstance(obj, dict)}
+
+def load_nodes(driver, path: pathlib.Path, source: str) -> Tuple[int, Buckets]:
+    """Pass 1 for one ifcJSON file; returns (nodes merged, its relationship buckets)."""
+    instances = open_instances(path)
     created = 0
 
-    # Start Neo4j session
+    # One session per worker: sessions are not thread-safe, the driver is
     with driver.session(database=DB) as s:
-        # Pass 1: create nodes
-        for guid, obj in inst.items():
+        # Pass 1: create nodes; IfcRel* objects also feed the Pass 2 buckets on the way
+        rows: List[Dict[str, Any]] = []
+        buckets: Buckets = defaultdict(list)
+        label_groups: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+
+        def flush_nodes():
+            write_tx(s, NODE_MERGE_Q, rows=rows, source=source)
+            rows.clear()
+
+        for guid, obj in instances:
             if not isinstance(obj, dict):
                 continue
             ifc_type = get_type(obj)
             name = get_name(obj)
             psets = extract_psets(obj)
-            psets_json = json.dumps(psets, ensure_ascii=False)
             props_flat = select_flat_props(psets)
 
             # Every node has :IfcEntity and its IFC type as a label
             label = cmms_label(ifc_type)
+            h = REL_HANDLERS.get(ifc_type)
+            if h is not None:
+                h(obj, buckets)
 
             # Attributes and flow direction
             attrs = obj.get("attributes") or {}
-            attrs_json = json.dumps(attrs, ensure_ascii=False)
             flow_dir = attrs.get("FlowDirection") or obj.get("FlowDirection")
 
             # MERGE by globalId
-            s.run(
-                """
-                MERGE (n:IfcEntity {globalId:$id})
-                ON CREATE SET
-                    n.name = $name,
-                    n.type = $ifc_type,
-                    n.source = $source,
-                    n.psets_json = $psets_json,
-                    n.attrs_json = $attrs_json,
-                    n.flowDirection = coalesce($flow_dir, n.flowDirection)
-                ON MATCH SET
-                    n.name = coalesce(n.name, $name),
-                    n.type = $ifc_type,
-                    n.source = coalesce(n.source, $source),
-                    n.psets_json = coalesce(n.psets_json, $psets_json),
-                    n.attrs_json = coalesce(n.attrs_json, $attrs_json),
-                    n.flowDirection = coalesce(n.flowDirection, $flow_dir)
-                SET n += $props_flat
-                """,
-                id=guid,
-                name=name,
-                ifc_type=ifc_type,
-                source=source,
-                psets_json=psets_json,
-                attrs_json=attrs_json,
-                flow_dir=flow_dir,
-                props_flat=props_flat,
-            )
-
-            # 2) Add labels AFTER merge (safe even if they already exist)
-            s.run(
-                """
-                MATCH (n:IfcEntity {globalId:$id})
-                CALL apoc.create.addLabels(n, $labels) YIELD node
-                RETURN node
-                """,
-                id=guid,
-                labels=[ifc_type, label],  # e.g., ["IfcSpace", "IfcSpace"]
-            )
+            rows.append({
+                "id": guid,
+                "name": name,
+                "ifc_type": ifc_type,
+                "psets": psets,
+                "attrs": attrs,
+                "flow_dir": flow_dir,
+                "props_flat": props_flat,
+                "reference": psets.get(REF_PSET_KEY),
+            })
+            label_groups[(ifc_type, label)].append(guid)  # e.g., ("IfcSpace", "IfcSpace")
             created += 1
+            if len(rows) >= BATCH:
+                flush_nodes()
+        if rows:
+            flush_nodes()
+        for (ifc_type, label), ids in label_groups.items():
+            labels = list(dict.fromkeys((ifc_type, label)))
+            for i in range(0, len(ids), LABEL_BATCH):
+                write_tx(s, ADD_LABELS_Q, ids=ids[i:i + LABEL_BATCH], labels=labels)
 
-        # Pass 2: relationships (look for IfcRel*)
-        for guid, obj in inst.items():
-            if not isinstance(obj, dict):
-                continue
-            t = get_type(obj)
-            if not t.startswith("IfcRel"):
-                continue
+    return created, buckets
+
+def write_rels(driver, buckets: Buckets) -> None:
+    """Pass 2 for one file: relationships, already bucketed per reltype during Pass 1."""
+    with driver.session(database=DB) as s:
+        for rel, rel_rows in buckets.items():
+            for i in range(0, len(rel_rows), BATCH):
+                write_tx(s, REL_MERGE_Q.format(rel=rel), rows=rel_rows[i:i + BATCH])
+
+def load_nodes_after(deps, driver, path: pathlib.Path, source: str) -> Tuple[int, Buckets]:
+    # deps were submitted earlier to the same FIFO pool, so each is already running or done
+    for d in deps:
+        d.result()
+    return load_nodes(driver, path, source)
 
-            # Common field names across exporters:
-            rs = obj.get("RelatingStructure") or obj.get("relatingStructure")
-            re = obj.get("RelatedElements") or obj.get("relatedElements")
-            ro = obj.get("RelatedObjects")  or obj.get("relatedObjects")
-            rb = obj.get("RelatedBuildings") or obj.get("relatedBuildings")
-            rg = obj.get("RelatingGroup") or obj.get("relatingGroup")
-            rso = obj.get("RelatingObject") or obj.get("relatingObject")
-
-            # Check for specific relationship types
-            if t == "IfcRelContainedInSpatialStructure" and rs and re:
-                parent = ref_id(rs)
-                kids = re if isinstance(re, list) else [re]
-                for k in kids:
-                    child = ref_id(k)
-                    if parent and child:
-                        # (Spatial) -[:CONTAINS]-> (Element)
-                        s.run("""
-                            MATCH (a {globalId:$a}), (b {globalId:$b})
-                            MERGE (a)-[:CONTAINS]->(b)
-                        """, a=parent, b=child)
-            
-            # Handle other relationship types
-            elif t == "IfcRelAggregates" and rso and ro:
-                parent = ref_id(rso)
-                kids = ro if isinstance(ro, list) else [ro]
-                for k in kids:
-                    child = ref_id(k)
-                    if parent and child:
-                        s.run("""
-                            MATCH (a {globalId:$a}), (b {globalId:$b})
-                            MERGE (a)-[:AGGREGATES]->(b)
-                        """, a=parent, b=child)
-
-            elif t == "IfcRelServicesBuildings" and rb:
-                sys_ref = ref_id(obj.get("RelatingSystem") or obj.get("relatingSystem"))
-                blds = rb if isinstance(rb, list) else [rb]
-                for b in blds:
-                    bld = ref_id(b)
-                    if sys_ref and bld:
-                        s.run("""
-                            MATCH (sys {globalId:$s}), (bld {globalId:$b})
-                            MERGE (sys)-[:SERVICES]->(bld)
-                        """, s=sys_ref, b=bld)
-
-            elif t == "IfcRelAssignsToGroup" and rg and ro:
-                sys_ref = ref_id(rg)
-                objs = ro if isinstance(ro, list) else [ro]
-                for o in objs:
-                    el = ref_id(o)
-                    if sys_ref and el:
-                        # (Element)-[:ASSIGNED_TO_SYSTEM]->(System)
-                        s.run("""
-                            MATCH (el {globalId:$e}), (sys {globalId:$s})
-                            MERGE (el)-[:ASSIGNED_TO_SYSTEM]->(sys)
-                        """, e=el, s=sys_ref)
-            
-            # Port attached to Element
-            elif t == "IfcRelConnectsPortToElement":
-                rp = obj.get("RelatingPort") or obj.get("relatingPort")
-                re = obj.get("RelatedElement") or obj.get("relatedElement")
-                port = ref_id(rp); elem = ref_id(re)
-                if port and elem:
-                    s.run("""
-                        MATCH (e {globalId:$e}), (p {globalId:$p})
-                        MERGE (e)-[:HAS_PORT]->(p)
-                    """, e=elem, p=port)
-
-            # Port connected to Port (bidirectional)
-            elif t == "IfcRelConnectsPorts":
-                pa = ref_id(obj.get("RelatingPort") or obj.get("relatingPort"))
-                pb = ref_id(obj.get("RelatedPort")  or obj.get("relatedPort"))
-                if pa and pb:
-                    s.run("""
-                        MATCH (a {globalId:$a}), (b {globalId:$b})
-                        MERGE (a)-[:PORT_CONNECTED_TO]->(b)
-                    """, a=pa, b=pb)
-
-            # Element connected to Element (bidirectional)
-            elif t == "IfcRelConnectsElements":
-                a = ref_id(obj.get("RelatingElement") or obj.get("relatingElement"))
-                b = ref_id(obj.get("RelatedElement")  or obj.get("relatedElement"))
-                if a and b:
-                    s.run("""
-                        MATCH (x {globalId:$a}), (y {globalId:$b})
-                        MERGE (x)-[:CONNECTED_TO]->(y)
-                    """, a=a, b=b)
-
-            # Element connected to Element via ports
-            s.run("""
-            MATCH (e1)-[:HAS_PORT]->(p1:IfcDistributionPort)-[:PORT_CONNECTED_TO]->(p2:IfcDistributionPort)<-[:HAS_PORT]-(e2)
-            MERGE (e1)-[:CONNECTED_TO]->(e2)
-            """)
-
-            # Directed FEEDS when port directions are available
-            s.run("""
-            MATCH (src)-[:HAS_PORT]->(p:IfcDistributionPort)-[:PORT_CONNECTED_TO]->(q:IfcDistributionPort)<-[:HAS_PORT]-(dst)
-            WHERE toUpper(coalesce(p.flowDirection,'')) CONTAINS 'SOURCE'
-            AND toUpper(coalesce(q.flowDirection,'')) CONTAINS 'SINK'
-            MERGE (src)-[:FEEDS]->(dst)
-            """)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="Path(s) to ifcJSON (or .jsonl) file(s), e.g. Arch and Mech")
+    parser.add_argument("--source", nargs="*", default=None, help="Logical source tag per path, e.g., Arch Mech")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Files ingested concurrently")
+    args = parser.parse_args()
+
+    paths = [pathlib.Path(p) for p in args.paths]
+    sources = args.source or [p.stem for p in paths]
+    if len(sources) != len(paths):
+        parser.error("--source needs one tag per path")
+
+    driver = GraphDatabase.driver(URI, auth=(USER, PASS))
+    with driver.session(database=DB) as s:
+        s.run(GID_CONSTRAINT_Q).consume()
+        s.run(NAME_FT_Q).consume()
+        s.run(REF_FT_Q).consume()
+
+    # Files go to separate threads; MERGE on the unique globalId keeps overlapping GUIDs safe.
+    # Which values survive on a shared GUID depends on write order (ON MATCH keeps the first
+    # file's name/source/psets and takes the last file's type), so a file's nodes wait for every
+    # earlier file it shares GUIDs with: the result is that of sequential runs in CLI order,
+    # while disjoint files still load side by side.
+    # Every file's nodes land before any edges, since a rel may point into another file.
+    with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(paths)))) as pool:
+        guids = list(pool.map(scan_guids, paths)) if len(paths) > 1 else [set()]
+        futs: List[Any] = []
+        for i, (path, src) in enumerate(zip(paths, sources)):
+            deps = [futs[j] for j in range(i) if not guids[i].isdisjoint(guids[j])]
+            futs.append(pool.submit(load_nodes_after, deps, driver, path, src))
+        del guids
+        results = {path: f.result() for path, f in zip(paths, futs)}
+        for f in [pool.submit(write_rels, driver, b) for _, b in results.values()]:
+            f.result()
+
+    # Graph-wide port post-pass: once, after all files. Unconditional, so port edges already in
+    # the graph (ifcjson_edges.py, earlier runs) get CONNECTED_TO/FEEDS too; matches nothing otherwise
+    with driver.session(database=DB) as s:
+        write_tx(s, PORT_CONNECTED_Q)
+        write_tx(s, PORT_FEEDS_Q)
 
     # Close Neo4j driver
     driver.close()
-    print(f"✅ Loaded nodes from %s. Created/merged: %d" % (path.name, created))
+    for path, (created, _) in results.items():
+        print(f"✅ Loaded nodes from %s. Created/merged: %d" % (path.name, created))
     print("✅ Relationships merged: CONTAINS / AGGREGATES / SERVICES / ASSIGNED_TO_SYSTEM (when present)")
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
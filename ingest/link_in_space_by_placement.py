@@ -1,6 +1,15 @@
 # ingest/link_in_space_by_placement.py
-import os, argparse, math
+import os, re, argparse, math, pathlib
 from typing import List, Tuple, Optional, Dict
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # SciPy is optional; assign_spaces() falls back to the NumPy scan
+    cKDTree = None
+try:
+    from numba import njit
+except ImportError:  # Numba is optional too; without it nearest_space() stays vectorised NumPy
+    njit = None
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 
@@ -13,7 +22,15 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+BATCH = 1000
+IN_SPACE_Q = """
+UNWIND $rows AS r
+MATCH (e:IfcEntity {globalId:r.e}), (sp:IfcEntity:IfcSpace {globalId:r.sp})
+MERGE (e)-[:IN_SPACE]->(sp)
+"""
+
 NAME_HINTS = ("diffuser", "air terminal", "grille", "register", "outlet")
+HINT_RE = re.compile("|".join(map(re.escape, NAME_HINTS)), re.I)  # one scan instead of five substring tests
 
 def world_origin(elem) -> Optional[Tuple[float,float,float]]:
     op = getattr(elem, "ObjectPlacement", None)
@@ -31,32 +48,91 @@ def safe_by_type(f, t):
 
 def is_diffuser_like(e) -> bool:
     n = getattr(e, "Name", "") or ""
-    nl = n.lower() if isinstance(n, str) else str(n).lower()
-    return any(h in nl for h in NAME_HINTS)
-
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("arch_ifc", help="ARCH IFC path (has IfcSpace placements)")
-    ap.add_argument("mech_ifc", help="MECH IFC path (has diffusers)")
-    ap.add_argument("--z_tol", type=float, default=3.0, help="Z tolerance in meters for space matching")
-    ap.add_argument("--xy_max", type=float, default=50.0, help="Optional XY cap (m). If >0, require XY distance < cap")
-    args = ap.parse_args()
+    return HINT_RE.search(n if isinstance(n, str) else str(n)) is not None
+
+if njit is not None:
+    @njit(cache=True)
+    def _nearest_idx(px, py, pz, xyz, z_tol, xy_max2):
+        # single pass: Z gate, XY cap, strict < keeps the first space on ties
+        best, best_d2 = -1, np.inf
+        for i in range(xyz.shape[0]):
+            if abs(pz - xyz[i, 2]) > z_tol:
+                continue
+            dx = px - xyz[i, 0]; dy = py - xyz[i, 1]
+            d2 = dx*dx + dy*dy
+            if d2 > xy_max2:
+                continue
+            if d2 < best_d2:
+                best_d2 = d2; best = i
+        return best
 
-    # 1) Load spaces with world origins
-    arch = ifcopenshell.open(args.arch_ifc)
+def nearest_space(spaces_xyz: np.ndarray, pt, z_tol: float, xy_max: float) -> int:
+    """Index of the XY-nearest space within z_tol (and xy_max if >0), or -1."""
+    px, py, pz = pt
+    if njit is not None:
+        return int(_nearest_idx(float(px), float(py), float(pz), spaces_xyz, float(z_tol),
+                                xy_max * xy_max if xy_max > 0 else np.inf))
+    d2 = (spaces_xyz[:, 0] - px) ** 2 + (spaces_xyz[:, 1] - py) ** 2
+    bad = np.abs(pz - spaces_xyz[:, 2]) > z_tol
+    if xy_max > 0:
+        bad |= d2 > xy_max * xy_max
+    d2[bad] = np.inf
+    i = int(d2.argmin())
+    return i if np.isfinite(d2[i]) else -1
+
+def assign_spaces(spaces_xyz: np.ndarray, pts, z_tol: float, xy_max: float, k: int = 8) -> np.ndarray:
+    """nearest_space() for every point at once, via an XY KD-tree when SciPy is available."""
+    if cKDTree is None or not len(pts):
+        return np.array([nearest_space(spaces_xyz, p, z_tol, xy_max) for p in pts], dtype=np.int64)
+    pts = np.asarray(pts, dtype=np.float64)
+    k = min(k, len(spaces_xyz))
+    d, idx = cKDTree(spaces_xyz[:, :2]).query(pts[:, :2], k=k)
+    if k == 1:
+        d, idx = d[:, None], idx[:, None]
+    cap = xy_max if xy_max > 0 else np.inf
+    # candidates come back sorted by XY distance: the first one passing the Z gate wins
+    ok = (np.abs(spaces_xyz[idx, 2] - pts[:, 2:3]) <= z_tol) & (d <= cap)
+    hit = ok.any(axis=1)
+    out = np.where(hit, idx[np.arange(len(pts)), ok.argmax(axis=1)], -1)
+    # all k neighbours Z-gated out (stacked storeys) but farther spaces may still pass: exact scan
+    if k < len(spaces_xyz):
+        for r in np.flatnonzero(~hit & (d[:, -1] <= cap)):
+            out[r] = nearest_space(spaces_xyz, pts[r], z_tol, xy_max)
+    return out
+
+def load_spaces(arch_path: str) -> Tuple[List[str], np.ndarray]:
+    """IfcSpace GUIDs and world origins from the ARCH IFC, cached under .cache/ by (name, mtime, size)."""
+    st = os.stat(arch_path)
+    cache = pathlib.Path(".cache") / f"{pathlib.Path(arch_path).name}.{st.st_mtime_ns}.{st.st_size}.spaces.npz"
+    if cache.exists():
+        z = np.load(cache)
+        return z["ids"].tolist(), z["xyz"]
+    arch = ifcopenshell.open(arch_path)
     spaces_pts: Dict[str, Tuple[float,float,float]] = {}
-    spaces_name: Dict[str, str] = {}
     for sp in safe_by_type(arch, "IfcSpace"):
         gid = getattr(sp, "GlobalId", None)
         if not gid: continue
         p = world_origin(sp)
         if not p: continue
         spaces_pts[gid] = p
-        nm = getattr(sp, "Name", "") or ""
-        ln = getattr(sp, "LongName", "") or ""
-        spaces_name[gid] = f"{nm} {ln}".strip()
+    xyz = np.asarray(list(spaces_pts.values()), dtype=np.float64).reshape(-1, 3)
+    cache.parent.mkdir(exist_ok=True)
+    tmp = cache.with_suffix(".tmp.npz")  # write-then-rename so a killed run never leaves a torn cache
+    np.savez(tmp, ids=np.asarray(list(spaces_pts.keys()), dtype=str), xyz=xyz)
+    os.replace(tmp, cache)
+    return list(spaces_pts.keys()), xyz
 
-    if not spaces_pts:
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("arch_ifc", help="ARCH IFC path (has IfcSpace placements)")
+    ap.add_argument("mech_ifc", help="MECH IFC path (has diffusers)")
+    ap.add_argument("--z_tol", type=float, default=3.0, help="Z tolerance in meters for space matching")
+    ap.add_argument("--xy_max", type=float, default=50.0, help="Optional XY cap (m). If >0, require XY distance < cap")
+    args = ap.parse_args()
+
+    # 1) Load spaces with world origins (cached across runs on the same ARCH file)
+    space_ids, spaces_xyz = load_spaces(args.arch_ifc)
+    if not space_ids:
         print("❌ No IfcSpace placements found in ARCH IFC (cannot link).")
         return
 
@@ -79,35 +155,16 @@ def main():
         print("❌ No diffuser-like terminals with placements found in MECH IFC.")
         return
 
-    # 3) Nearest-space assignment with Z gating
-    def nearest_space(pt):
-        px,py,pz = pt
-        best = None
-        best_d2 = 1e99
-        for sgid, (sx,sy,sz) in spaces_pts.items():
-            if abs(pz - sz) > args.z_tol:
-                continue
-            dx = px - sx; dy = py - sy
-            d2 = dx*dx + dy*dy
-            if args.xy_max > 0 and (dx*dx + dy*dy) > args.xy_max*args.xy_max:
-                continue
-            if d2 < best_d2:
-                best_d2 = d2; best = sgid
-        return best
-
-    links = []
-    for gid, p in terminals:
-        sp = nearest_space(p)
-        if sp:
-            links.append((gid, sp))
+    # 3) Nearest-space assignment with Z gating (one KD-tree query for all terminals)
+    best = assign_spaces(spaces_xyz, [p for _, p in terminals], args.z_tol, args.xy_max)
+    links = [(gid, space_ids[i]) for (gid, _), i in zip(terminals, best) if i >= 0]
 
     drv = GraphDatabase.driver(URI, auth=(USER, PASS))
     with drv.session(database=DB) as s:
-        for e_gid, sp_gid in links:
-            s.run("""
-                MATCH (e {globalId:$e}), (sp:IfcSpace {globalId:$sp})
-                MERGE (e)-[:IN_SPACE]->(sp)
-            """, e=e_gid, sp=sp_gid)
+        rows = [{"e": e_gid, "sp": sp_gid} for e_gid, sp_gid in links]
+        for i in range(0, len(rows), BATCH):
+            batch = rows[i:i + BATCH]
+            s.execute_write(lambda tx: tx.run(IN_SPACE_Q, rows=batch).consume())
     drv.close()
     print(f"✅ Linked {len(links)} diffuser-like elements → IN_SPACE "
           f"(z_tol={args.z_tol}m, xy_max={args.xy_max if args.xy_max>0 else '∞'}m)")
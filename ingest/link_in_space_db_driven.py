@@ -1,5 +1,10 @@
-import os, argparse, math
-from typing import Dict, Tuple, Optional
+import os, argparse, math, pathlib
+from typing import Dict, List, Tuple, Optional
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # SciPy is optional; assign_spaces() falls back to the NumPy scan
+    cKDTree = None
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 import ifcopenshell
@@ -11,6 +16,13 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+BATCH = 1000
+IN_SPACE_Q = """
+UNWIND $rows AS r
+MATCH (e:IfcEntity {globalId:r.e}), (sp:IfcEntity:IfcSpace {globalId:r.sp})
+MERGE (e)-[:IN_SPACE]->(sp)
+"""
+
 def world_origin(e):
     op = getattr(e, "ObjectPlacement", None)
     if not op: return None
@@ -20,12 +32,62 @@ def world_origin(e):
     except Exception:
         return None
 
-def build_guid_index(f):
-    idx = {}
-    for e in f:  # iterate whole file once
-        gid = getattr(e, "GlobalId", None)
-        if gid: idx[gid] = e
-    return idx
+def by_guid(f, gid):
+    # ifcopenshell keeps its own GlobalId map; unknown ids raise instead of returning None
+    try:
+        return f.by_guid(gid)
+    except RuntimeError:
+        return None
+
+def nearest_space(spaces_xyz: np.ndarray, pt, z_tol: float, xy_max: float) -> int:
+    """Index of the XY-nearest space within z_tol (and xy_max if >0), or -1."""
+    px, py, pz = pt
+    d2 = (spaces_xyz[:, 0] - px) ** 2 + (spaces_xyz[:, 1] - py) ** 2
+    bad = np.abs(pz - spaces_xyz[:, 2]) > z_tol
+    if xy_max > 0:
+        bad |= d2 > xy_max * xy_max
+    d2[bad] = np.inf
+    i = int(d2.argmin())
+    return i if np.isfinite(d2[i]) else -1
+
+def assign_spaces(spaces_xyz: np.ndarray, pts, z_tol: float, xy_max: float, k: int = 8) -> np.ndarray:
+    """nearest_space() for every point at once, via an XY KD-tree when SciPy is available."""
+    if cKDTree is None or not len(pts):
+        return np.array([nearest_space(spaces_xyz, p, z_tol, xy_max) for p in pts], dtype=np.int64)
+    pts = np.asarray(pts, dtype=np.float64)
+    k = min(k, len(spaces_xyz))
+    d, idx = cKDTree(spaces_xyz[:, :2]).query(pts[:, :2], k=k)
+    if k == 1:
+        d, idx = d[:, None], idx[:, None]
+    cap = xy_max if xy_max > 0 else np.inf
+    # candidates come back sorted by XY distance: the first one passing the Z gate wins
+    ok = (np.abs(spaces_xyz[idx, 2] - pts[:, 2:3]) <= z_tol) & (d <= cap)
+    hit = ok.any(axis=1)
+    out = np.where(hit, idx[np.arange(len(pts)), ok.argmax(axis=1)], -1)
+    # all k neighbours Z-gated out (stacked storeys) but farther spaces may still pass: exact scan
+    if k < len(spaces_xyz):
+        for r in np.flatnonzero(~hit & (d[:, -1] <= cap)):
+            out[r] = nearest_space(spaces_xyz, pts[r], z_tol, xy_max)
+    return out
+
+def load_spaces(arch_path: str) -> Tuple[List[str], np.ndarray]:
+    """IfcSpace GUIDs and world origins from the ARCH IFC, cached under .cache/ by (name, mtime, size)."""
+    st = os.stat(arch_path)
+    cache = pathlib.Path(".cache") / f"{pathlib.Path(arch_path).name}.{st.st_mtime_ns}.{st.st_size}.spaces.npz"
+    if cache.exists():
+        z = np.load(cache)
+        return z["ids"].tolist(), z["xyz"]
+    arch = ifcopenshell.open(arch_path)
+    spaces_pts: Dict[str, Tuple[float,float,float]] = {}
+    for sp in arch.by_type("IfcSpace"):
+        p = world_origin(sp)
+        if p: spaces_pts[sp.GlobalId] = p
+    xyz = np.asarray(list(spaces_pts.values()), dtype=np.float64).reshape(-1, 3)
+    cache.parent.mkdir(exist_ok=True)
+    tmp = cache.with_suffix(".tmp.npz")  # write-then-rename so a killed run never leaves a torn cache
+    np.savez(tmp, ids=np.asarray(list(spaces_pts.keys()), dtype=str), xyz=xyz)
+    os.replace(tmp, cache)
+    return list(spaces_pts.keys()), xyz
 
 def main():
     ap = argparse.ArgumentParser()
@@ -46,57 +108,40 @@ def main():
        OR t.source IN $sources
     RETURN DISTINCT t.globalId AS id
     """
+    if args.limit:
+        q += "LIMIT $limit"  # cap server-side rather than pulling every row and slicing
     with drv.session(database=DB) as s:
-        ids = [r["id"] for r in s.run(q, sources=args.mech_sources)]
-    if args.limit and len(ids) > args.limit:
-        ids = ids[:args.limit]
+        ids = s.run(q, sources=args.mech_sources, limit=args.limit).value("id")
     print(f"Neo4j candidates: {len(ids)}")
 
-    # 2) Load IFCs and precompute placements
-    arch = ifcopenshell.open(args.arch_ifc)
-    mech = ifcopenshell.open(args.mech_ifc)
-    mech_idx = build_guid_index(mech)
-
-    spaces_pts: Dict[str, Tuple[float,float,float]] = {}
-    for sp in arch.by_type("IfcSpace"):
-        p = world_origin(sp)
-        if p: spaces_pts[sp.GlobalId] = p
-    if not spaces_pts:
+    # 2) Load IFCs and precompute placements (spaces cached across runs on the same ARCH file)
+    space_ids, spaces_xyz = load_spaces(args.arch_ifc)
+    if not space_ids:
         print("❌ No IfcSpace placements found in ARCH IFC.")
         return
+    mech = ifcopenshell.open(args.mech_ifc)
 
     # 3) For each candidate GUID, find element in MECH and get placement
-    pairs = []
+    located = []
     for gid in ids:
-        e = mech_idx.get(gid)
-        if not e: 
+        e = by_guid(mech, gid) if gid else None
+        if not e:
             continue
         p = world_origin(e)
         if not p:
             continue
-        # nearest space by XY with optional Z gating
-        px,py,pz = p
-        best, best_d2 = None, 1e99
-        for sgid, (sx,sy,sz) in spaces_pts.items():
-            if abs(pz - sz) > args.z_tol:
-                continue
-            dx,dy = px-sx, py-sy
-            d2 = dx*dx + dy*dy
-            if args.xy_max>0 and d2 > args.xy_max*args.xy_max:
-                continue
-            if d2 < best_d2:
-                best_d2, best = d2, sgid
-        if best:
-            pairs.append((gid, best))
+        located.append((gid, p))
+    # nearest space by XY with optional Z gating
+    best = assign_spaces(spaces_xyz, [p for _, p in located], args.z_tol, args.xy_max)
+    pairs = [(gid, space_ids[i]) for (gid, _), i in zip(located, best) if i >= 0]
     print(f"Pairs to link: {len(pairs)}")
 
     # 4) Write IN_SPACE edges
     with drv.session(database=DB) as s:
-        for egid, spgid in pairs:
-            s.run("""
-                MATCH (e {globalId:$e}), (sp:IfcSpace {globalId:$sp})
-                MERGE (e)-[:IN_SPACE]->(sp)
-            """, e=egid, sp=spgid)
+        rows = [{"e": e_gid, "sp": sp_gid} for e_gid, sp_gid in pairs]
+        for i in range(0, len(rows), BATCH):
+            batch = rows[i:i + BATCH]
+            s.execute_write(lambda tx: tx.run(IN_SPACE_Q, rows=batch).consume())
     drv.close()
     print("✅ Done.")
 
@@ -1,6 +1,19 @@
 # ingest/link_in_space_from_two_ifc.py
-import os, argparse
+import os, re, argparse, multiprocessing
 from typing import Dict, Tuple, Optional, List
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # SciPy is optional; nearest_center() falls back to a NumPy scan
+    cKDTree = None
+try:
+    import simsimd  # SIMD distance kernels for that scan, no [n,K,3] temporary
+except ImportError:
+    simsimd = None
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional; assign_spaces() then runs the NumPy/SciPy passes
+    njit = None
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 
@@ -14,27 +27,24 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+BATCH = 1000
+GID_CONSTRAINT_Q = "CREATE CONSTRAINT ifcentity_gid IF NOT EXISTS FOR (n:IfcEntity) REQUIRE n.globalId IS UNIQUE"
+IN_SPACE_Q = """
+UNWIND $rows AS r
+MATCH (e:IfcEntity {globalId:r.e}), (sp:IfcEntity:IfcSpace {globalId:r.sp})
+MERGE (e)-[:IN_SPACE]->(sp)
+"""
+
 NAME_HINTS = ("diffuser", "air terminal", "grille", "register", "outlet")
+HINT_RE = re.compile("|".join(map(re.escape, NAME_HINTS)), re.I)  # one scan instead of five substring tests
 
 def safe_by_type(f, t):
     try: return f.by_type(t)
     except Exception: return []
 
 def aabb_of_shape(sh) -> Tuple[float,float,float,float,float,float]:
-    vs = sh.geometry.verts
-    xs, ys, zs = vs[0::3], vs[1::3], vs[2::3]
-    return (min(xs),min(ys),min(zs), max(xs),max(ys),max(zs))
-
-def center(aabb):
-    x0,y0,z0,x1,y1,z1 = aabb
-    return ((x0+x1)/2.0, (y0+y1)/2.0, (z0+z1)/2.0)
-
-def contains(aabb, p, tol_xy=0.10, tol_z=1.0):
-    x0,y0,z0,x1,y1,z1 = aabb
-    x,y,z = p
-    return (x0 - tol_xy <= x <= x1 + tol_xy and
-            y0 - tol_xy <= y <= y1 + tol_xy and
-            z0 - tol_z  <= z <= z1 + tol_z)
+    a = np.asarray(sh.geometry.verts, dtype=np.float64).reshape(-1, 3)  # flat [x0,y0,z0,x1,...] -> [V,3]
+    return tuple(np.concatenate((a.min(0), a.max(0))).tolist())
 
 def world_origin(e) -> Optional[Tuple[float,float,float]]:
     op = getattr(e, "ObjectPlacement", None)
@@ -47,8 +57,131 @@ def world_origin(e) -> Optional[Tuple[float,float,float]]:
 
 def is_diffuser_like(e) -> bool:
     n = getattr(e, "Name", "") or ""
-    nl = n.lower() if isinstance(n, str) else str(n).lower()
-    return any(h in nl for h in NAME_HINTS)
+    return HINT_RE.search(n if isinstance(n, str) else str(n)) is not None
+
+def space_aabbs(settings, ifc) -> Dict[str, Tuple[float,float,float,float,float,float]]:
+    """AABB per tessellable IfcSpace, tessellated across all cores by geom.iterator."""
+    # only spaces with a Representation; the iterator skips any that still fail to tessellate
+    spaces = [sp for sp in safe_by_type(ifc, "IfcSpace") if getattr(sp, "Representation", None)]
+    if not spaces:
+        return {}
+    boxes = {}
+    it = geom.iterator(settings, ifc, multiprocessing.cpu_count(), include=spaces)
+    if it.initialize():
+        while True:
+            sh = it.get()
+            boxes[sh.guid] = aabb_of_shape(sh)
+            if not it.next():
+                break
+    # workers finish out of order; keep by_type order, "first containing space" depends on it
+    return {sp.GlobalId: boxes[sp.GlobalId] for sp in spaces if sp.GlobalId in boxes}
+
+def space_arrays(space_aabb: Dict[str, Tuple[float,float,float,float,float,float]]):
+    """(gids, mins[K,3], maxs[K,3]) with rows in space_aabb order."""
+    gids = list(space_aabb.keys())
+    boxes = np.asarray(list(space_aabb.values()), dtype=np.float64).reshape(-1, 6)
+    return gids, boxes[:, :3], boxes[:, 3:]
+
+def nearest_center(centers: np.ndarray, pts: np.ndarray, chunk=1024) -> np.ndarray:
+    """Index of the nearest space center per point; one KD-tree query when SciPy is available."""
+    if cKDTree is not None:
+        return cKDTree(centers).query(pts, k=1, workers=-1)[1]
+    out = np.empty(len(pts), dtype=np.int64)
+    for i in range(0, len(pts), chunk):
+        if simsimd is not None:
+            d2 = simsimd.cdist(pts[i:i + chunk], centers, metric="sqeuclidean", threads=0)
+            out[i:i + chunk] = np.asarray(d2).argmin(1)
+            continue
+        diff = pts[i:i + chunk, None, :] - centers
+        # squared distance is the sort key: argmin straight off einsum, never sqrt
+        out[i:i + chunk] = np.einsum("nkd,nkd->nk", diff, diff).argmin(1)
+    return out
+
+# boxes wider (along the sweep axis) than this quantile skip the sweep for a brute-force pass
+WIDE_Q = 0.99
+
+def first_containing(lo: np.ndarray, hi: np.ndarray, pts: np.ndarray, chunk=4096) -> np.ndarray:
+    """Sweep-and-prune: lowest index of a box lo<=p<=hi containing each point, or -1.
+
+    The space rule: a point is inside an AABB widened by tol_xy on x/y and tol_z on z, bounds
+    inclusive; assign_spaces passes lo = mins - tol, hi = maxs + tol.
+    """
+    # sweep along whichever of X/Y spreads the boxes out more
+    ax = int(np.argmax((lo[:, :2] + hi[:, :2]).var(axis=0)))
+    # the window is the widest swept box, so a few floor/site-wide spaces would make every box a
+    # candidate for every point; those outliers get a brute-force pass of their own instead
+    w = hi[:, ax] - lo[:, ax]
+    cut = np.quantile(w, WIDE_Q)
+    wide, narrow = np.flatnonzero(w > cut), np.flatnonzero(w <= cut)
+    order = narrow[np.argsort(lo[narrow, ax], kind="stable")]
+    lo_s = lo[order, ax]
+    # any narrow box holding x starts in [x - widest narrow, x]; the slack only widens it, the test is exact
+    span = float(w[narrow].max()) * (1 + 1e-9) + 1e-9
+    out = np.full(len(pts), len(lo), dtype=np.int64)
+    for i in range(0, len(pts), chunk):
+        p = pts[i:i + chunk]
+        start = np.searchsorted(lo_s, p[:, ax] - span, "left")
+        counts = np.searchsorted(lo_s, p[:, ax], "right") - start
+        # flatten (point, candidate) pairs for one vectorised containment test
+        pi = np.repeat(np.arange(len(p)), counts)
+        ci = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - start, counts)]
+        ok = ((p[pi] >= lo[ci]) & (p[pi] <= hi[ci])).all(1)
+        np.minimum.at(out, pi[ok] + i, ci[ok])
+        if len(wide):
+            hit = ((p[:, None] >= lo[wide]) & (p[:, None] <= hi[wide])).all(2)
+            # wide is ascending, so argmax is the lowest containing index; merged so lowest still wins
+            first = np.where(hit.any(1), wide[hit.argmax(1)], len(lo))
+            np.minimum(out[i:i + chunk], first, out=out[i:i + chunk])
+    out[out == len(lo)] = -1
+    return out
+
+# The fused kernel is O(N*K); with SciPy present the sweep + KD-tree passes win past this many spaces
+FUSED_MAX_K = 256
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _assign_fused(lo, hi, centers, pts, out):
+        # one pass per point over the same K boxes: containment with early exit, else nearest
+        # center (squared distance, first minimum wins as in argmin). No fastmath, so the
+        # comparisons round exactly like the NumPy path.
+        for i in prange(pts.shape[0]):
+            px, py, pz = pts[i, 0], pts[i, 1], pts[i, 2]
+            best = -1
+            for k in range(lo.shape[0]):
+                if (lo[k, 0] <= px <= hi[k, 0] and lo[k, 1] <= py <= hi[k, 1]
+                        and lo[k, 2] <= pz <= hi[k, 2]):
+                    best = k
+                    break
+            if best < 0:
+                best, bd = 0, np.inf
+                for k in range(centers.shape[0]):
+                    dx, dy, dz = px - centers[k, 0], py - centers[k, 1], pz - centers[k, 2]
+                    d = dx * dx + dy * dy + dz * dz
+                    if d < bd:
+                        best, bd = k, d
+            out[i] = best
+
+def assign_spaces(mins: np.ndarray, maxs: np.ndarray, pts, tol_xy=0.10, tol_z=1.0, chunk=1024) -> np.ndarray:
+    """Per point: first space whose tolerance-widened AABB contains it, else the nearest space center."""
+    pts = np.asarray(pts, dtype=np.float64).reshape(-1, 3)
+    tol = np.array([tol_xy, tol_xy, tol_z])
+    if njit is not None and (cKDTree is None or len(mins) <= FUSED_MAX_K):
+        out = np.empty(len(pts), dtype=np.int64)
+        _assign_fused(mins - tol, maxs + tol, 0.5 * (mins + maxs), pts, out)
+        return out
+    out = first_containing(mins - tol, maxs + tol, pts)
+    miss = np.flatnonzero(out < 0)
+    if len(miss):
+        out[miss] = nearest_center(0.5 * (mins + maxs), pts[miss], chunk)
+    return out
+
+def write_links(drv, rows: List[Dict[str, str]]) -> None:
+    """IN_SPACE edges as BATCH-sized UNWINDs, one write transaction each."""
+    with drv.session(database=DB) as s:
+        s.run(GID_CONSTRAINT_Q).consume()
+        for i in range(0, len(rows), BATCH):
+            batch = rows[i:i + BATCH]
+            s.execute_write(lambda tx: tx.run(IN_SPACE_Q, rows=batch).consume())
 
 def main():
     ap = argparse.ArgumentParser()
@@ -62,13 +195,7 @@ def main():
 
     # 1) Build AABBs for ARCH spaces
     arch = ifcopenshell.open(args.arch_ifc)
-    space_aabb: Dict[str, Tuple[float,float,float,float,float,float]] = {}
-    for sp in safe_by_type(arch, "IfcSpace"):
-        try:
-            sh = geom.create_shape(s, sp)
-            space_aabb[sp.GlobalId] = aabb_of_shape(sh)
-        except Exception:
-            continue
+    space_aabb = space_aabbs(s, arch)
 
     if not space_aabb:
         print("No space geometry available from ARCH IFC.")
@@ -89,38 +216,20 @@ def main():
         if gid and gid not in seen:
             seen.add(gid); terms.append(e)
 
-    drv = GraphDatabase.driver(URI, auth=(USER, PASS))
-    assigned = 0
-    with drv.session(database=DB) as session:
-        for t in terms:
-            p = world_origin(t)
-            if not p: 
-                continue
-            # First: try containment
-            hit = None
-            for sp_gid, aabb in space_aabb.items():
-                if contains(aabb, p):
-                    hit = sp_gid
-                    break
-            # Fallback: nearest space center
-            if not hit:
-                best_d2, best_sp = 1e99, None
-                for sp_gid, aabb in space_aabb.items():
-                    cx,cy,cz = center(aabb)
-                    d2 = (cx-p[0])**2 + (cy-p[1])**2 + (cz-p[2])**2
-                    if d2 < best_d2:
-                        best_d2, best_sp = d2, sp_gid
-                hit = best_sp
-
-            if hit:
-                session.run("""
-                    MATCH (e {globalId:$e}), (sp:IfcSpace {globalId:$sp})
-                    MERGE (e)-[:IN_SPACE]->(sp)
-                """, e=t.GlobalId, sp=hit)
-                assigned += 1
+    located = []
+    for t in terms:
+        p = world_origin(t)
+        if p:
+            located.append((t.GlobalId, p))
+    # First: containment; fallback: nearest space center (all points at once)
+    gids, mins, maxs = space_arrays(space_aabb)
+    best = assign_spaces(mins, maxs, [p for _, p in located])
+    rows = [{"e": e_gid, "sp": gids[i]} for (e_gid, _), i in zip(located, best)]
 
+    drv = GraphDatabase.driver(URI, auth=(USER, PASS))
+    write_links(drv, rows)
     drv.close()
-    print(f"✅ Linked {assigned} diffuser-like elements → IN_SPACE")
+    print(f"✅ Linked {len(rows)} diffuser-like elements → IN_SPACE")
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
 # ingest/print_placements_probe.py
+import re
 import statistics as stats
 import ifcopenshell
 from ifcopenshell.util.placement import get_local_placement
@@ -19,13 +20,11 @@ def world_origin(e):
     m = get_local_placement(op)  # 4x4 transform
     return (float(m[0][3]), float(m[1][3]), float(m[2][3]))
 
+HINT_RE = re.compile(r"diffuser|air terminal|grille|register|outlet", re.I)
+
 def is_diffuser_like(e):
     n = getattr(e, "Name", "") or ""
-    nl = n.lower() if isinstance(n, str) else str(n).lower()
-    for h in ("diffuser", "air terminal", "grille", "register", "outlet"):
-        if h in nl:
-            return True
-    return False
+    return HINT_RE.search(n if isinstance(n, str) else str(n)) is not None
 
 def pts_summary(tag, pts):
     if not pts:
@@ -1,5 +1,10 @@
 import json, pathlib
-ev = json.loads(pathlib.Path("data/processed/evidence.json").read_text())
+try:
+    import orjson  # C decoder; evidence dumps can run to several MB
+except ImportError:
+    orjson = None
+raw = pathlib.Path("data/processed/evidence.json").read_bytes()
+ev = orjson.loads(raw) if orjson is not None else json.loads(raw)
 nodes = {n["id"]: n for n in ev["nodes"]}
 spaces  = sorted({n["name"] for n in ev["nodes"] if "IfcSpace" in (n.get("labels") or []) and n.get("name")})
 storeys = sorted({n["name"] for n in ev["nodes"] if "IfcBuildingStorey" in (n.get("labels") or []) and n.get("name")})
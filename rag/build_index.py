@@ -1,7 +1,8 @@
 # rag/build_index.py
-import os, json, pathlib
-from typing import List, Dict, Any
+import os, json, pathlib, shutil, tempfile
+from typing import List, Dict, Any, Iterator, Iterable
 import numpy as np
+import torch
 from neo4j import GraphDatabase
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
@@ -17,6 +18,19 @@ OUT_DIR = pathlib.Path("data/processed/rag")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 MODEL_NAME = os.getenv("EMB_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# fp16 weights on GPU (tensor cores); CPU stays fp32, where half matmuls are slow
+EMB_FP16 = DEVICE == "cuda" and os.getenv("RAG_EMB_FP16", "1") == "1"
+
+# below IVF_MIN vectors a flat (SQ8) scan is fast enough; above it use IVF-PQ
+IVF_MIN    = int(os.getenv("RAG_IVF_MIN", "50000"))
+IVF_NLIST  = int(os.getenv("RAG_IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+PQ_M       = int(os.getenv("RAG_PQ_M", "48"))
+# flat-index storage: "8bit" (int8 codes, 4x smaller), "fp16" (2x) or "fp32" (exact)
+FLAT_SQ    = os.getenv("RAG_FLAT_SQ", "8bit")
+# rows are pulled, carded, encoded and added to the index this many at a time
+NODE_BATCH = int(os.getenv("RAG_NODE_BATCH", "4096"))
 
 TOP_PSET_KEYS = {
     "Pset_Manufacturer.Manufacturer",
@@ -30,32 +44,54 @@ TOP_PSET_KEYS = {
     "Pset_MemberCommon.LoadBearing",
 }
 
-def load_nodes_with_context() -> List[Dict[str, Any]]:
+def count_nodes() -> int:
     drv = GraphDatabase.driver(URI, auth=(USER, PASS))
-    rows = []
     with drv.session(database=DB) as s:
-        q = """
-        MATCH (n:IfcEntity)
-        OPTIONAL MATCH (st:IfcBuildingStorey)-[:CONTAINS*1..4]->(n)
-        OPTIONAL MATCH (sp:IfcSpace)-[:CONTAINS*0..4]->(n)
-        OPTIONAL MATCH (n)-[:ASSIGNED_TO_SYSTEM]->(sys:IfcSystem)
-        WITH n,
-             collect(DISTINCT st.name) AS storeys,
-             collect(DISTINCT sp.name) AS spaces,
-             collect(DISTINCT sys.name) AS systems
-        RETURN
-            n.globalId AS id,
-            labels(n)   AS labels,
-            n.name      AS name,
-            n.type      AS ifcType,
-            n.source    AS source,
-            n.psets_json AS psets_json,
-            storeys, spaces, systems
-        """
-        for r in s.run(q):
-            rows.append(dict(r))
+        n = s.run("MATCH (n:IfcEntity) RETURN count(n) AS c").single()["c"]
     drv.close()
-    return rows
+    return n
+
+def load_nodes_with_context() -> Iterator[Dict[str, Any]]:
+    """Stream node rows; the driver pulls them from the server NODE_BATCH at a time."""
+    drv = GraphDatabase.driver(URI, auth=(USER, PASS))
+    try:
+        with drv.session(database=DB, fetch_size=NODE_BATCH) as s:
+            q = """
+            MATCH (n:IfcEntity)
+            OPTIONAL MATCH (st:IfcBuildingStorey)-[:CONTAINS*1..4]->(n)
+            OPTIONAL MATCH (sp:IfcSpace)-[:CONTAINS*0..4]->(n)
+            OPTIONAL MATCH (n)-[:ASSIGNED_TO_SYSTEM]->(sys:IfcSystem)
+            WITH n,
+                 collect(DISTINCT st.name) AS storeys,
+                 collect(DISTINCT sp.name) AS spaces,
+                 collect(DISTINCT sys.name) AS systems
+            RETURN
+                n.globalId AS id,
+                labels(n)   AS labels,
+                n.name      AS name,
+                n.type      AS ifcType,
+                n.source    AS source,
+                n.psets_json AS psets_json,
+                storeys, spaces, systems
+            """
+            result = s.run(q)
+            try:
+                for r in result:
+                    yield r.data()
+            finally:
+                result.consume()  # also discards the rest if the consumer stops early
+    finally:
+        drv.close()
+
+def batched(it: Iterable, n: int) -> Iterator[List]:
+    buf = []
+    for x in it:
+        buf.append(x)
+        if len(buf) >= n:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
 
 def text_card(n: Dict[str, Any]) -> str:
     labels = [lab for lab in (n.get("labels") or []) if lab != "IfcEntity"]
@@ -103,33 +139,95 @@ def text_card(n: Dict[str, Any]) -> str:
 
     return " | ".join(parts)
 
+def new_faiss_index(n: int, dim: int):
+    """Empty inner-product index for n normalised vectors: flat SQ for small N, IVF-PQ otherwise.
+    Returns (index, kind, train_n), train_n being how many vectors to train on first."""
+    if n < IVF_MIN:
+        if FLAT_SQ == "fp32":
+            return faiss.IndexFlatIP(dim), "flat", 0
+        # QT_8bit trains a per-dim [min,max] range (the vectors are in [-1,1]; QT_8bit_direct
+        # expects 0..255 inputs), QT_fp16 needs no training
+        qt = faiss.ScalarQuantizer.QT_fp16 if FLAT_SQ == "fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(dim, qt, faiss.METRIC_INNER_PRODUCT)
+        return index, f"flat,SQ{FLAT_SQ}", n
+    # ~39 training points per centroid keeps k-means happy; PQ needs m | dim
+    nlist = max(1, min(IVF_NLIST, n // 39))
+    m = PQ_M if dim % PQ_M == 0 else next(d for d in (32, 24, 16, 8, 4, 2, 1) if dim % d == 0)
+    quant = faiss.IndexFlatIP(dim)
+    index = faiss.IndexIVFPQ(quant, dim, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+    index.nprobe = min(IVF_NPROBE, nlist)  # stored in the file, so query.py needs no change
+    return index, f"IVF{nlist},PQ{m}", min(n, max(64 * nlist, 10000))
+
+def build_faiss_index(n: int, dim: int, vec_batches: Iterable[np.ndarray]):
+    """Add vectors batch by batch; only the training sample is ever held in memory."""
+    index, kind, train_n = new_faiss_index(n, dim)
+    pending: List[np.ndarray] = []
+    def train_and_flush():
+        sample = np.concatenate(pending)
+        index.train(sample)
+        index.add(sample)
+        pending.clear()
+    for v in vec_batches:
+        if index.is_trained:
+            index.add(v)
+            continue
+        pending.append(v)
+        if sum(len(p) for p in pending) >= train_n:
+            train_and_flush()
+    if pending:
+        train_and_flush()
+    return index, kind
+
+def write_meta(path: pathlib.Path, head: Dict[str, Any], ids_f, texts_f):
+    # ids/texts were spooled as comma-joined JSON strings; splice them into meta.json
+    with open(path, "w", encoding="utf-8") as out:
+        out.write(json.dumps(head)[:-1] + ', "ids": [')
+        ids_f.seek(0); shutil.copyfileobj(ids_f, out)
+        out.write('], "texts": [')
+        texts_f.seek(0); shutil.copyfileobj(texts_f, out)
+        out.write("]}")
+
 def main():
-    print("🔌 Fetching nodes + context from Neo4j …")
-    nodes = load_nodes_with_context()
-    if not nodes:
+    print("🔌 Counting nodes in Neo4j …")
+    total = count_nodes()
+    if not total:
         print("No nodes found. Did you ingest yet?")
         return
 
-    print(f"🧱 Building text cards for {len(nodes)} nodes …")
-    texts = [text_card(n) for n in nodes]
-
-    print(f"🧠 Loading embedding model: {MODEL_NAME}")
-    model = SentenceTransformer(MODEL_NAME)
-    vecs = model.encode(texts, batch_size=256, show_progress_bar=True,
-                        convert_to_numpy=True, normalize_embeddings=True).astype("float32")
-    dim = vecs.shape[1]
-
-    index = faiss.IndexFlatIP(dim)
-    index.add(vecs)
-
-    faiss.write_index(index, str(OUT_DIR / "index.faiss"))
-    meta = {
-        "model": MODEL_NAME,
-        "dim": dim,
-        "ids": [n["id"] for n in nodes],
-        "texts": texts,
-    }
-    (OUT_DIR / "meta.json").write_text(json.dumps(meta))
+    print(f"🧠 Loading embedding model: {MODEL_NAME} ({DEVICE}{', fp16' if EMB_FP16 else ''})")
+    model = SentenceTransformer(MODEL_NAME, device=DEVICE)
+    if EMB_FP16:
+        model.half()
+    dim = model.get_sentence_embedding_dimension()
+
+    print(f"🧱 Streaming text cards + embeddings for {total} nodes, {NODE_BATCH} at a time …")
+    ids_f = tempfile.TemporaryFile("w+", encoding="utf-8")
+    texts_f = tempfile.TemporaryFile("w+", encoding="utf-8")
+    done = 0
+    def vec_batches():
+        nonlocal done
+        for rows in batched(load_nodes_with_context(), NODE_BATCH):
+            texts = [text_card(n) for n in rows]
+            sep = "," if done else ""
+            ids_f.write(sep + ",".join(json.dumps(n["id"]) for n in rows))
+            texts_f.write(sep + ",".join(json.dumps(t) for t in texts))
+            done += len(rows)
+            # FAISS takes float32 only; the cast is cheap next to the forward pass
+            yield model.encode(texts, batch_size=256, convert_to_numpy=True,
+                               normalize_embeddings=True).astype("float32")
+            print(f"   … {done}/{total}", end="\r", flush=True)
+
+    with ids_f, texts_f:
+        index, kind = build_faiss_index(total, dim, vec_batches())
+        print(f"\n🗂️  FAISS index: {kind} ({index.ntotal} vectors)")
+
+        faiss.write_index(index, str(OUT_DIR / "index.faiss"))
+        head = {
+            "model": MODEL_NAME,
+            "dim": dim,
+            "index": kind,
+        }
+        write_meta(OUT_DIR / "meta.json", head, ids_f, texts_f)
     print(f"✅ Saved index to {OUT_DIR/'index.faiss'} and metadata to {OUT_DIR/'meta.json'}")
 
 if __name__ == "__main__":
@@ -1,11 +1,17 @@
 # rag/query.py
-import os, json, pathlib, re
+import os, sys, json, pathlib, re, atexit
+from functools import lru_cache
 from typing import List, Dict, Any, Tuple
 import numpy as np
+import torch
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 from sentence_transformers import SentenceTransformer
 import faiss
+try:
+    import orjson  # C encoder/decoder for meta.json and evidence dumps
+except ImportError:
+    orjson = None
 
 load_dotenv()
 URI  = os.getenv("NEO4J_URI", "bolt://localhost:7687")
@@ -13,10 +19,26 @@ USER = os.getenv("NEO4J_USER", "neo4j")
 PASS = os.getenv("NEO4J_PASSWORD", "changeme123")
 DB   = os.getenv("NEO4J_DATABASE", "neo4j")
 
+# one pooled driver per process; sessions borrow connections instead of reconnecting
+DRV = GraphDatabase.driver(URI, auth=(USER, PASS), max_connection_pool_size=32)
+atexit.register(DRV.close)
+
+def read_json(path: pathlib.Path) -> Any:
+    raw = path.read_bytes()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def dump_json(obj: Any, indent: bool = False) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
 RAG_DIR = pathlib.Path("data/processed/rag")
-META = json.loads((RAG_DIR / "meta.json").read_text())
+META = read_json(RAG_DIR / "meta.json")
 INDEX = faiss.read_index(str(RAG_DIR / "index.faiss"))
-MODEL = SentenceTransformer(META["model"])
+# load once per process and pin to the GPU when there is one
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+MODEL = SentenceTransformer(META["model"], device=DEVICE)
+EMB_BATCH = int(os.getenv("RAG_EMB_BATCH", "64"))
 
 # Curated reltypes we care about; we’ll intersect with what actually exists.
 DESIRED_RELS = [
@@ -27,53 +49,99 @@ DESIRED_RELS = [
 HOPS = int(os.getenv("RAG_HOPS", "3"))
 TOPK = int(os.getenv("RAG_TOPK", "20"))
 
-def embed(text: str) -> np.ndarray:
-    v = MODEL.encode([text], convert_to_numpy=True, normalize_embeddings=True)
+_TOK_RE  = re.compile(r"[A-Za-z0-9\-]+")
+_BIAS_RE = re.compile(r"\b(ahu|vav|terminal|diffuser|grille|register)\b", re.I)
+
+def embed_batch(texts: List[str]) -> np.ndarray:
+    """Encode N texts in one model call -> (N, dim) float32, L2-normalised."""
+    v = MODEL.encode(texts, batch_size=EMB_BATCH, convert_to_numpy=True, normalize_embeddings=True)
     return v.astype(np.float32)
 
+def embed(text: str) -> np.ndarray:
+    return embed_batch([text])
+
+def vector_seeds_batch(questions: List[str], k: int = TOPK) -> List[List[Tuple[int, float]]]:
+    # one encode + one FAISS search for the whole batch
+    scores, idxs = INDEX.search(embed_batch(questions), k)
+    return [list(zip(i.tolist(), sc.tolist())) for i, sc in zip(idxs, scores)]
+
 def vector_seeds(question: str, k: int = TOPK) -> List[Tuple[int, float]]:
-    scores, idxs = INDEX.search(embed(question), k)
-    return list(zip(idxs[0].tolist(), scores[0].tolist()))
+    return vector_seeds_batch([question], k)[0]
+
+# Name match: Lucene query on the ifcName full-text index (graph/schema.cypher), best score first;
+# the label-scan CONTAINS form is kept for graphs ingested before that index existed
+NAME_FT_SUBQ = """
+CALL {
+  CALL db.index.fulltext.queryNodes('ifcName', $ftq) YIELD node
+  WITH DISTINCT node.globalId AS id LIMIT 50
+  RETURN collect(id) AS byName
+}"""
+NAME_SCAN_SUBQ = """
+CALL {
+  MATCH (n:IfcEntity)
+  WHERE any(t IN $toks WHERE toLower(n.name) CONTAINS toLower(t))
+  WITH DISTINCT n.globalId AS id LIMIT 50
+  RETURN collect(id) AS byName
+}"""
+# Pset Reference (common in 2x3 proxies): ingest promotes it to n.reference under the
+# ifcReference full-text index; older graphs only have it inside psets_json
+REF_FT_SUBQ = """
+CALL {
+  CALL db.index.fulltext.queryNodes('ifcReference', $ftq) YIELD node
+  WITH DISTINCT node.globalId AS id LIMIT 50
+  RETURN collect(id) AS byRef
+}"""
+REF_SCAN_SUBQ = """
+CALL {
+  UNWIND $toks AS tok
+  MATCH (n:IfcEntity)
+  WITH n, tok, apoc.convert.fromJsonMap(n.psets_json) AS p
+  WITH n, tok, toLower(toString(p['Pset_BuildingElementProxyCommon.Reference'])) AS ref
+  WHERE ref CONTAINS toLower(tok)
+  WITH DISTINCT n.globalId AS id LIMIT 50
+  RETURN collect(id) AS byRef
+}"""
+# name match, pset Reference match and the Mech bias in one round trip;
+# each unit subquery collects its own ordered, LIMITed id list
+LEXICAL_Q = """{name}{ref}
+CALL {
+  UNWIND $needles AS needle
+  CALL {
+    WITH needle
+    MATCH (n:IfcEntity {source:'Mech'})
+    WHERE toLower(n.name) CONTAINS needle
+    WITH DISTINCT n.globalId AS id LIMIT 50
+    RETURN collect(id) AS ids
+  }
+  RETURN apoc.coll.flatten(collect(ids)) AS byMech
+}
+RETURN byName, byRef, byMech
+"""
+MECH_NEEDLES = ["vav", "ahu", "diffuser", "terminal"]
+
+@lru_cache(maxsize=None)
+def has_fulltext(index: str) -> bool:
+    with DRV.session(database=DB) as s:
+        q = "SHOW FULLTEXT INDEXES YIELD name WHERE name = $name RETURN count(*) AS c"
+        return s.run(q, name=index).single()["c"] > 0
+
+def fulltext_query(toks: List[str]) -> str:
+    # prefix match per token ("vav" finds "VAV-1-02"); hyphenated tokens go in as phrases,
+    # since the analyzer splits them and a bare '-' is Lucene's NOT operator. Lowercased:
+    # wildcard terms skip the analyzer, and it keeps AND/OR/NOT from reading as operators.
+    return " OR ".join(f'"{t}"' if "-" in t else f"{t}*" for t in (t.lower() for t in toks))
 
 def lexical_seeds(question: str) -> List[str]:
-    import re
-    toks = [t for t in re.findall(r"[A-Za-z0-9\-]+", question) if len(t) >= 2]
+    toks = [t for t in _TOK_RE.findall(question) if len(t) >= 2]
     if not toks:
         return []
-    drv = GraphDatabase.driver(URI, auth=(USER, PASS))
-    ids: List[str] = []
-    with drv.session(database=DB) as s:
-        # Name match
-        like_parts = [f"toLower(n.name) CONTAINS toLower($t{idx})" for idx, _ in enumerate(toks)]
-        params = {f"t{idx}": tok for idx, tok in enumerate(toks)}
-        q1 = f"""
-        MATCH (n:IfcEntity)
-        WHERE {" OR ".join(like_parts)}
-        RETURN DISTINCT n.globalId AS id LIMIT 50
-        """
-        ids += [r["id"] for r in s.run(q1, **params)]
-
-        # Pset Reference (common in 2x3 proxies)
-        q2 = """
-        UNWIND $toks AS tok
-        MATCH (n:IfcEntity)
-        WITH n, tok, apoc.convert.fromJsonMap(n.psets_json) AS p
-        WITH n, tok, toLower(toString(p['Pset_BuildingElementProxyCommon.Reference'])) AS ref
-        WHERE ref CONTAINS toLower(tok)
-        RETURN DISTINCT n.globalId AS id LIMIT 50
-        """
-        ids += [r["id"] for r in s.run(q2, toks=toks)]
-
-        # Bias to Mech when query mentions AHU/VAV/terminal/diffuser
-        if re.search(r"\b(ahu|vav|terminal|diffuser|grille|register)\b", question.lower()):
-            q3 = """
-            MATCH (n:IfcEntity {source:'Mech'})
-            WHERE toLower(n.name) CONTAINS toLower($needle)
-            RETURN DISTINCT n.globalId AS id LIMIT 50
-            """
-            for needle in ("vav","ahu","diffuser","terminal"):
-                ids += [r["id"] for r in s.run(q3, needle=needle)]
-    drv.close()
+    # Bias to Mech when query mentions AHU/VAV/terminal/diffuser
+    needles = MECH_NEEDLES if _BIAS_RE.search(question) else []
+    q = (LEXICAL_Q.replace("{name}", NAME_FT_SUBQ if has_fulltext("ifcName") else NAME_SCAN_SUBQ)
+                  .replace("{ref}", REF_FT_SUBQ if has_fulltext("ifcReference") else REF_SCAN_SUBQ))
+    with DRV.session(database=DB) as s:
+        rec = s.run(q, toks=toks, ftq=fulltext_query(toks), needles=needles).single()
+    ids: List[str] = (rec["byName"] + rec["byRef"] + rec["byMech"]) if rec else []
     # de-dupe while preserving order
     seen, out = set(), []
     for i in ids:
@@ -83,8 +151,7 @@ def lexical_seeds(question: str) -> List[str]:
 
 
 def expand_neighborhood(seed_ids: List[str]) -> Dict[str, Any]:
-    drv = GraphDatabase.driver(URI, auth=(USER, PASS))
-    with drv.session(database=DB) as s:
+    with DRV.session(database=DB) as s:
         # discover existing rel types
         rels_row = s.run("MATCH ()-[r]->() RETURN collect(DISTINCT type(r)) AS t").single()
         existing = rels_row["t"] if rels_row and rels_row["t"] else []
@@ -113,7 +180,6 @@ def expand_neighborhood(seed_ids: List[str]) -> Dict[str, Any]:
             for n in rec["nodes"]:
                 nodes[n["id"]] = n
             edges.extend(rec["edges"])
-    drv.close()
 
     seen, uniq = set(), []
     for e in edges:
@@ -123,38 +189,77 @@ def expand_neighborhood(seed_ids: List[str]) -> Dict[str, Any]:
 
     return {"nodes": list(nodes.values()), "edges": uniq}
 
-def build_evidence(question: str, k: int = TOPK) -> Dict[str, Any]:
-    # 1) vector seeds
-    v_seeds = vector_seeds(question, k=k)
+def build_evidence(question: str, k: int = TOPK,
+                   v_seeds: List[Tuple[int, float]] = None) -> Dict[str, Any]:
+    # 1) vector seeds (callers batching several questions pass them in)
+    if v_seeds is None:
+        v_seeds = vector_seeds(question, k=k)
     # 2) lexical seeds
     lex_ids = lexical_seeds(question)
     # merge (favor lexical by putting first and giving them a tiny score boost for readability)
     id_map = META["ids"]
-    merged_ids = [*lex_ids]
-    merged_ids += [id_map[i] for i,_ in v_seeds if id_map[i] not in merged_ids]
+    lex_set = set(lex_ids)
+    merged_ids = list(lex_ids); seen = set(lex_set)
+    for i, _ in v_seeds:
+        if i < 0:
+            continue
+        gid = id_map[i]
+        if gid not in seen:
+            seen.add(gid); merged_ids.append(gid)
     merged_ids = merged_ids[:k]
 
     sub = expand_neighborhood(merged_ids)
     return {
         "question": question,
-        "focus_seeds": [{"id": sid, "score": 1.0 if sid in lex_ids else 0.0} for sid in merged_ids],
+        "focus_seeds": [{"id": sid, "score": 1.0 if sid in lex_set else 0.0} for sid in merged_ids],
         "nodes": sub["nodes"],
         "edges": sub["edges"],
     }
 
+def build_evidence_batch(questions: List[str], k: int = TOPK) -> List[Dict[str, Any]]:
+    seeds = vector_seeds_batch(questions, k=k)
+    return [build_evidence(q, k=k, v_seeds=vs) for q, vs in zip(questions, seeds)]
+
+def serve(k: int = TOPK):
+    # long-running mode: one question per stdin line, one evidence JSON per stdout line.
+    # Lines that arrive in the same read are embedded together (EMB_BATCH at a time).
+    fd, pending = sys.stdin.fileno(), b""
+    while True:
+        chunk = os.read(fd, 1 << 16)
+        if chunk:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+        else:
+            lines, pending = [pending], b""
+        qs = [ln.decode("utf-8", "replace").strip() for ln in lines]
+        qs = [q for q in qs if q]
+        for i in range(0, len(qs), EMB_BATCH):
+            for ev in build_evidence_batch(qs[i:i + EMB_BATCH], k=k):
+                sys.stdout.buffer.write(dump_json(ev) + b"\n")
+        sys.stdout.buffer.flush()
+        if not chunk:
+            break
+
 def main():
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("question", nargs="+")
+    parser.add_argument("question", nargs="*")
     parser.add_argument("--k", type=int, default=TOPK)
     parser.add_argument("--out", default="data/processed/evidence.json")
+    parser.add_argument("--stdin", action="store_true",
+                        help="read questions line by line from stdin and write JSONL evidence to stdout")
     args = parser.parse_args()
+    if args.stdin:
+        serve(k=args.k)
+        return
+    if not args.question:
+        parser.error("question is required unless --stdin is given")
     q = " ".join(args.question)
 
     print(f"🔎 Query: {q}")
     ev = build_evidence(q, k=args.k)
     out_path = pathlib.Path(args.out)
-    out_path.write_text(json.dumps(ev, indent=2))
+    out_path.write_bytes(dump_json(ev, indent=True))
     print(f"✅ Wrote evidence to {out_path}")
 
     # preview useful nodes
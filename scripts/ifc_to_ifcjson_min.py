@@ -1,47 +1,134 @@
-import json, sys, pathlib, math
-from typing import Any, Dict, List
+import json, sys, pathlib, math, argparse, multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
 try:
     import ifcopenshell
+    import ifcopenshell.ifcopenshell_wrapper as W
 except Exception as e:
     print("ERROR: ifcopenshell not available. `pip install ifcopenshell` first.")
     raise
+try:
+    import orjson  # compiled encoder for the output; stdlib json otherwise
+except ImportError:
+    orjson = None
+
+# ifcopenshell >= 0.8 entities are the SWIG objects themselves; older releases wrap them
+_WRAPPED = ifcopenshell.entity_instance is not W.entity_instance
+
+# Pass 1 reads these by positional index instead of getattr/hasattr (each a trip through
+# entity_instance.__getattr__, and a raised AttributeError whenever the attribute is missing)
+ATTRS = ("GlobalId", "Name", "LongName", "ObjectType", "Description", "FlowDirection", "PredefinedType")
+_ATTR_IDX: Dict[Tuple[str, str], Tuple[Optional[int], ...]] = {}
+# below this many entities a process pool costs more than it saves
+PAR_MIN = 50000
+
+def attr_indices(schema: str, t: str) -> Tuple[Optional[int], ...]:
+    """Positions of ATTRS in entity type t (None where t lacks one), resolved once per type."""
+    idx = _ATTR_IDX.get((schema, t))
+    if idx is None:
+        names = [a.name() for a in W.schema_by_name(schema).declaration_by_name(t).all_attributes()]
+        idx = _ATTR_IDX[(schema, t)] = tuple(names.index(a) if a in names else None for a in ATTRS)
+    return idx
+
+_MISSING = object()
 
 def sv(v):
-    # Safely extract scalar from IFC typed values (e.g., IfcLabel, IfcText, IfcIdentifier)
-    try:
-        return v.wrappedValue  # older ifcopenshell
-    except Exception:
-        pass
-    try:
-        return v.value  # newer ifcopenshell
-    except Exception:
-        pass
-    return v
-
-def get_name(ent) -> str:
-    for attr in ("Name", "LongName"):
-        if hasattr(ent, attr):
-            val = getattr(ent, attr)
+    # Safely extract scalar from IFC typed values (e.g., IfcLabel, IfcText, IfcIdentifier);
+    # getattr defaults instead of try/except, so plain scalars raise nothing
+    if isinstance(v, (str, int, float)):
+        return v  # what get_argument() gives for defined types; no attribute probes needed
+    r = getattr(v, "wrappedValue", _MISSING)  # older ifcopenshell
+    if r is _MISSING:
+        r = getattr(v, "value", v)  # newer ifcopenshell
+    return r
+
+PORT_TYPES = ("IfcDistributionPort", "IfcPort")
+# Type names, pset keys and enum values repeat across thousands of entities; interned, the
+# held-in-memory instances share one str each and dict lookups on them hit by identity
+intern = sys.intern
+_istr = lambda v: intern(str(v))
+_OUT_ATTRS: Dict[Tuple[str, str], Tuple[Tuple[str, int, Any], ...]] = {}
+
+def out_attrs(schema: str, t: str, idx: Tuple[Optional[int], ...]) -> Tuple[Tuple[str, int, Any], ...]:
+    """(key, position, converter) for the Entry attributes of type t, in output order."""
+    fields = [("ObjectType", idx[3], sv), ("Description", idx[4], sv)]
+    if t in PORT_TYPES:
+        fields[:0] = [("FlowDirection", idx[5], _istr), ("PredefinedType", idx[6], _istr)]
+    r = _OUT_ATTRS[(schema, t)] = tuple(f for f in fields if f[1] is not None)
+    return r
+
+def get_name(data, idx: Tuple[Optional[int], ...]) -> str:
+    for i in (idx[1], idx[2]):  # Name, then LongName
+        if i is not None:
+            val = data.get_argument(i)
             if val:
                 val = sv(val)
                 if isinstance(val, str) and val.strip():
                     return val.strip()
     return ""
 
-def extract_psets(ent) -> Dict[str, Any]:
+# IfcRelDefinesByProperties and its only subtype (2x3); IfcPropertySet and
+# IfcPropertySingleValue have none in 2x3/4/4x3
+DBP_TYPES = frozenset(("IfcRelDefinesByProperties", "IfcRelOverridesProperties"))
+
+_PSET_IDX: Dict[str, Tuple[int, int, int, int, int]] = {}
+
+def pset_indices(schema: str) -> Tuple[int, int, int, int, int]:
+    """Positions of RelatingPropertyDefinition, pset Name/HasProperties, property Name/NominalValue."""
+    idx = _PSET_IDX.get(schema)
+    if idx is None:
+        S = W.schema_by_name(schema)
+        pos = lambda t, a: [x.name() for x in S.declaration_by_name(t).all_attributes()].index(a)
+        idx = _PSET_IDX[schema] = (
+            pos("IfcRelDefinesByProperties", "RelatingPropertyDefinition"),
+            pos("IfcPropertySet", "Name"), pos("IfcPropertySet", "HasProperties"),
+            pos("IfcPropertySingleValue", "Name"), pos("IfcPropertySingleValue", "NominalValue"),
+        )
+    return idx
+
+_DEFINED_BY: Dict[Tuple[str, str], bool] = {}
+# shared psets of entities with no IsDefinedBy rels; never mutated, only encoded
+_NO_PSETS: Dict[str, Any] = {}
+
+def has_defined_by(schema: str, t: str) -> bool:
+    """Whether type t has the IsDefinedBy inverse (IfcPropertySet, say, does not in 2x3)."""
+    r = _DEFINED_BY.get((schema, t))
+    if r is None:
+        inv = W.schema_by_name(schema).declaration_by_name(t).all_inverse_attributes()
+        r = _DEFINED_BY[(schema, t)] = any(a.name() == "IsDefinedBy" for a in inv)
+    return r
+
+def defined_by(ent, data):
+    # getattr on a name the type lacks goes through the express-rule lookup
+    # in entity_instance.__getattr__; callers check has_defined_by first
+    if _WRAPPED:
+        return getattr(ent, "IsDefinedBy", None)
+    return data._get_inverse("IsDefinedBy")
+
+def extract_psets(rels, schema: str) -> Dict[str, Any]:
+    # One walk over raw instances by attribute position: get_argument() and is_a() behave the same
+    # on the SWIG objects of every ifcopenshell release, while attribute access goes through
+    # entity_instance.__getattr__ per read. is_a() with no argument skips the inheritance walk
+    # of is_a(name), so types are matched by name (DBP_TYPES lists the one subtype).
+    i_pdef, i_psname, i_props, i_pname, i_val = pset_indices(schema)
     out: Dict[str, Any] = {}
-    rels = getattr(ent, "IsDefinedBy", None) or []
     for r in rels:
-        if not r or not r.is_a("IfcRelDefinesByProperties"):
+        if r is None:
+            continue
+        if _WRAPPED:
+            r = r.wrapped_data
+        if r.is_a() not in DBP_TYPES:
             continue
-        pdef = r.RelatingPropertyDefinition
-        if not pdef or not pdef.is_a("IfcPropertySet"):
+        pdef = r.get_argument(i_pdef)
+        if pdef is None or pdef.is_a() != "IfcPropertySet":
             continue
-        pset_name = sv(pdef.Name) if getattr(pdef, "Name", None) else "Pset"
-        for p in pdef.HasProperties or []:
-            if p.is_a("IfcPropertySingleValue"):
-                key = f"{pset_name}.{sv(p.Name)}" if getattr(p, "Name", None) else pset_name
-                val = sv(p.NominalValue) if getattr(p, "NominalValue", None) else None
+        pset_name = intern(pdef.get_argument(i_psname) or "Pset")
+        prefix = pset_name + "."  # built once per set; each key is then a single concat
+        for p in pdef.get_argument(i_props) or ():
+            if p.is_a() == "IfcPropertySingleValue":
+                pname = p.get_argument(i_pname)
+                key = intern(prefix + pname) if pname else pset_name
+                nv = p.get_argument(i_val)
+                val = nv.get_argument(0) if nv is not None else None  # typed value -> scalar
                 # keep scalars only
                 if isinstance(val, (str, int, float, bool)) or val is None:
                     out[key] = val
@@ -49,98 +136,214 @@ def extract_psets(ent) -> Dict[str, Any]:
                     out[key] = str(val)
     return out
 
+class Entry:
+    """Pass 1 record for a GUID entity; becomes a dict only when written out."""
+    __slots__ = ("type", "Name", "attributes", "psets")
+
+    def __init__(self, t: str, name: str, attributes: Dict[str, Any], psets: Dict[str, Any]):
+        self.type, self.Name, self.attributes, self.psets = t, name, attributes, psets
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"type": self.type, "Name": self.Name, "attributes": self.attributes, "psets": self.psets}
+
+# one shared {"ref": gid} per GUID (an element sits in many rels); never mutated, only encoded
+_REF_CACHE: Dict[str, Dict[str, str]] = {}
+_EMPTY: Dict[str, str] = {}
+
+def ref_gid(gid: Optional[str]) -> Dict[str, str]:
+    if not gid:
+        return _EMPTY
+    r = _REF_CACHE.get(gid)
+    if r is None:
+        r = _REF_CACHE[gid] = {"ref": gid}
+    return r
+
 def ref(obj) -> Dict[str, str]:
-    return {"ref": obj.GlobalId} if obj and getattr(obj, "GlobalId", None) else {}
+    # rel endpoints are all IfcRoot, so GlobalId is argument 0 of the raw instance
+    return ref_gid(obj.get_argument(0) if obj is not None else None)
 
-def convert(ifc_path: pathlib.Path, out_path: pathlib.Path):
-    f = ifcopenshell.open(str(ifc_path))
-    instances: Dict[str, Dict[str, Any]] = {}
+# one shared endpoint list per GUID tuple (the same set often sits in several rels); also read-only
+_REFS_CACHE: Dict[Tuple[str, ...], List[Dict[str, str]]] = {}
 
-    # Pass 1: dump entities with GUIDs (IfcProject..IfcElement..IfcSystem..IfcSpace..)
-    for ent in f:
-        gid = getattr(ent, "GlobalId", None)
-        if not gid:
-            continue
-        t = ent.is_a()
-        entry: Dict[str, Any] = {
-            "type": t,
-            "Name": get_name(ent),
-            "attributes": {},     # you can add more later
-            "psets": extract_psets(ent),
-        }
-
-        if t in ("IfcDistributionPort", "IfcPort"):
-            fd = getattr(ent, "FlowDirection", None)
-            if fd:
-                entry.setdefault("attributes", {})["FlowDirection"] = str(fd)
-            pdt = getattr(ent, "PredefinedType", None)
-            if pdt:
-                entry.setdefault("attributes", {})["PredefinedType"] = str(pdt)
-
-        # minimal useful attributes
-        for attr in ("ObjectType", "Description"):
-            if hasattr(ent, attr) and getattr(ent, attr):
-                entry["attributes"][attr] = sv(getattr(ent, attr))
-        instances[gid] = entry
-
-    # Pass 2: add core IfcRel* instances we care about
-    def put_rel(rel_type: str, make):
-        for r in f.by_type(rel_type):
-            gid = getattr(r, "GlobalId", None)
-            if not gid:
-                continue
-            instances[gid] = {"type": rel_type, **make(r)}
+def refs(seq) -> List[Dict[str, str]]:
+    gids = tuple([e.get_argument(0) for e in seq])
+    r = _REFS_CACHE.get(gids)
+    if r is None:
+        r = _REFS_CACHE[gids] = list(map(ref_gid, gids))
+    return r
 
+# Core IfcRel* instances we care about, keyed by base type (subtypes included, as by_type did):
+# output key, and whether it holds a list of endpoints
+REL_BUILDERS = {
     # Spatial containment
-    put_rel("IfcRelContainedInSpatialStructure", lambda r: {
-        "RelatingStructure": ref(r.RelatingStructure),
-        "RelatedElements": [ref(e) for e in (r.RelatedElements or [])],
-    })
-
+    "IfcRelContainedInSpatialStructure": (("RelatingStructure", False), ("RelatedElements", True)),
     # Aggregation (e.g., Building -> Storeys, Assemblies)
-    put_rel("IfcRelAggregates", lambda r: {
-        "RelatingObject": ref(r.RelatingObject),
-        "RelatedObjects": [ref(e) for e in (r.RelatedObjects or [])],
-    })
-
+    "IfcRelAggregates": (("RelatingObject", False), ("RelatedObjects", True)),
     # Systems serving buildings (may be more common in IFC4, but safe to include)
-    put_rel("IfcRelServicesBuildings", lambda r: {
-        "RelatingSystem": ref(r.RelatingSystem),
-        "RelatedBuildings": [ref(b) for b in (r.RelatedBuildings or [])],
-    })
-
+    "IfcRelServicesBuildings": (("RelatingSystem", False), ("RelatedBuildings", True)),
     # Assign elements to groups/systems (MEP systems)
-    put_rel("IfcRelAssignsToGroup", lambda r: {
-        "RelatingGroup": ref(r.RelatingGroup),
-        "RelatedObjects": [ref(e) for e in (r.RelatedObjects or [])],
-    })
-
+    "IfcRelAssignsToGroup": (("RelatingGroup", False), ("RelatedObjects", True)),
     # Port to Element
-    put_rel("IfcRelConnectsPortToElement", lambda r: {
-        "RelatingPort": ref(r.RelatingPort),
-        "RelatedElement": ref(r.RelatedElement),
-    })
-
+    "IfcRelConnectsPortToElement": (("RelatingPort", False), ("RelatedElement", False)),
     # Port to Port
-    put_rel("IfcRelConnectsPorts", lambda r: {
-        "RelatingPort": ref(r.RelatingPort),
-        "RelatedPort": ref(r.RelatedPort),
-    })
-
+    "IfcRelConnectsPorts": (("RelatingPort", False), ("RelatedPort", False)),
     # Element to Element
-    put_rel("IfcRelConnectsElements", lambda r: {
-        "RelatingElement": ref(r.RelatingElement),
-        "RelatedElement": ref(r.RelatedElement),
-    })
+    "IfcRelConnectsElements": (("RelatingElement", False), ("RelatedElement", False)),
+}
+_REL_POS: Dict[Tuple[str, str], Tuple[Tuple[str, int, bool], ...]] = {}
+
+def rel_fields(schema: str, rel: str) -> Tuple[Tuple[str, int, bool], ...]:
+    """REL_BUILDERS[rel] with attribute positions (subtypes keep their base type's)."""
+    names = [a.name() for a in W.schema_by_name(schema).declaration_by_name(rel).all_attributes()]
+    r = _REL_POS[(schema, rel)] = tuple((k, names.index(k), agg) for k, agg in REL_BUILDERS[rel])
+    return r
+
+def build_rel(rel: str, fields: Tuple[Tuple[str, int, bool], ...], data) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"type": rel}
+    for key, i, agg in fields:
+        v = data.get_argument(i)  # one read per attribute; aggregates come back as a tuple
+        out[key] = refs(v or ()) if agg else ref(v)
+    return out
+
+_REL_OF: Dict[Tuple[str, str], Optional[str]] = {}
+
+def rel_kind(schema: str, t: str) -> Optional[str]:
+    """REL_BUILDERS key that type t is (or inherits from), else None; resolved once per type."""
+    if (schema, t) not in _REL_OF:
+        decl = W.schema_by_name(schema).declaration_by_name(t)
+        while decl is not None and decl.name() not in REL_BUILDERS:
+            decl = decl.supertype()
+        _REL_OF[(schema, t)] = decl.name() if decl is not None else None
+    return _REL_OF[(schema, t)]
+
+def _dumps(v: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(v, option=orjson.OPT_INDENT_2)
+    return json.dumps(v, indent=2).encode("utf-8")
+
+def write_instances(out_path: pathlib.Path, instances: Dict[str, Any]):
+    """Layout of json.dumps({"instances": instances}, indent=2), one instance at a time."""
+    with open(out_path, "wb", buffering=1 << 20) as fh:
+        if not instances:
+            fh.write(b'{\n  "instances": {}\n}')
+            return
+        fh.write(b'{\n  "instances": {')
+        sep = b"\n    "
+        for gid, v in instances.items():
+            if isinstance(v, Entry):
+                v = v.as_dict()
+            # raw newlines only occur between tokens (strings escape theirs), so re-indenting is safe
+            fh.write(sep + _dumps(gid) + b": " + _dumps(v).replace(b"\n", b"\n    "))
+            sep = b",\n    "
+        fh.write(b"\n  }\n}")
+
+def _dumps_line(v: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(v)
+    return json.dumps(v, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def write_instances_seq(out_path: pathlib.Path, instances: Dict[str, Any]):
+    """One compact {"id": gid, ...} object per line, so readers can stream instance by instance."""
+    with open(out_path, "wb", buffering=1 << 20) as fh:
+        for gid, v in instances.items():
+            if isinstance(v, Entry):
+                v = v.as_dict()
+            fh.write(_dumps_line({"id": gid, **v}) + b"\n")
+
+def collect(f, ids) -> Dict[str, Any]:
+    """GUID -> Entry (or a plain dict for relationships) for the entities with these ids."""
+    instances: Dict[str, Any] = {}
+    # One pass: dump entities with GUIDs (IfcProject..IfcElement..IfcSystem..IfcSpace..);
+    # the REL_BUILDERS relationships get their endpoint refs in the same sweep
+    schema = f.schema
+    for eid in ids:
+        ent = f[eid]
+        t = intern(ent.is_a())
+        idx = _ATTR_IDX.get((schema, t)) or attr_indices(schema, t)
+        if idx[0] is None:
+            continue
+        data = ent.wrapped_data if _WRAPPED else ent
+        gid = data.get_argument(idx[0])
+        if not gid:
+            continue
+        rel = rel_kind(schema, t)
+        if rel is not None:
+            instances[gid] = build_rel(rel, _REL_POS.get((schema, rel)) or rel_fields(schema, rel), data)
+            continue
+        # minimal useful attributes (port flow/type first, as before); add more in out_attrs
+        attributes: Dict[str, Any] = {}
+        for attr, i, conv in _OUT_ATTRS.get((schema, t)) or out_attrs(schema, t, idx):
+            val = data.get_argument(i)
+            if val:
+                attributes[attr] = conv(val)
+        rels = defined_by(ent, data) if has_defined_by(schema, t) else None
+        psets = extract_psets(rels, schema) if rels else _NO_PSETS
+        instances[gid] = Entry(t, get_name(data, idx), attributes, psets)
+    return instances
+
+# Every GUID entity is an IfcRoot, so the by_type index skips the geometry/point entities
+# up front instead of Pass 1 fetching each one to find it has no GlobalId
+ROOT_TYPES = ("IfcRoot",)
+
+def entity_ids(f, include=ROOT_TYPES, exclude=()) -> List[int]:
+    """Ids of instances of the include types (and subtypes) minus exclude, in file order."""
+    keep = {e.id() for t in include for e in f.by_type(t)}
+    keep.difference_update(e.id() for t in exclude for e in f.by_type(t))
+    # the order `for ent in f` visits entities in (0.7 keeps entity_names on wrapped_data)
+    names = getattr(f, "entity_names", None) or f.wrapped_data.entity_names
+    return [i for i in names() if i in keep]
+
+# Worker state: fork inherits the parent's parsed file; spawned workers parse their own
+_F = None
+_IDS: List[int] = []
+
+def _pool_init(ifc_path: str, include, exclude):
+    global _F, _IDS
+    if _F is None:
+        _F = ifcopenshell.open(ifc_path)
+        _IDS = entity_ids(_F, include, exclude)
+
+def _shard(bounds: Tuple[int, int]) -> Dict[str, Any]:
+    return collect(_F, _IDS[bounds[0]:bounds[1]])
+
+def convert(ifc_path: pathlib.Path, out_path: pathlib.Path, workers: int = 1, ndjson: bool = False,
+            include=ROOT_TYPES, exclude=()):
+    global _F, _IDS
+    f = ifcopenshell.open(str(ifc_path))
+    ids = entity_ids(f, include, exclude)
+    if workers > 1 and len(ids) >= PAR_MIN:
+        # contiguous id shards, merged in order, so the output matches a serial run
+        n = workers * 4
+        step = -(-len(ids) // n)
+        bounds = [(lo, min(lo + step, len(ids))) for lo in range(0, len(ids), step)]
+        _F, _IDS = f, ids
+        instances: Dict[str, Any] = {}
+        try:
+            with multiprocessing.Pool(workers, initializer=_pool_init, initargs=(str(ifc_path), include, exclude)) as pool:
+                for part in pool.imap(_shard, bounds):
+                    instances.update(part)
+        finally:
+            _F, _IDS = None, []
+    else:
+        instances = collect(f, ids)
 
     # Output
-    out = {"instances": instances}
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(json.dumps(out, indent=2))
+    (write_instances_seq if ndjson or out_path.suffix == ".jsonl" else write_instances)(out_path, instances)
     print(f"✅ Wrote {out_path}  | instances: {len(instances)}")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python scripts/ifc_to_ifcjson_min.py <in.ifc> <out.json>")
-        sys.exit(2)
-    convert(pathlib.Path(sys.argv[1]), pathlib.Path(sys.argv[2]))
+    ap = argparse.ArgumentParser(description="Minimal IFC -> ifcJSON (GUID entities, psets, core IfcRel*)")
+    ap.add_argument("in_ifc")
+    ap.add_argument("out_json")
+    ap.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                    help=f"processes for the entity sweep (under {PAR_MIN} selected entities run serially)")
+    ap.add_argument("--ndjson", action="store_true",
+                    help='one {"id": GUID, ...} instance per line (implied by a .jsonl out_json)')
+    ap.add_argument("--include-types", nargs="+", default=list(ROOT_TYPES), metavar="TYPE",
+                    help="only these IFC types and their subtypes (default: IfcRoot, i.e. everything with a GUID)")
+    ap.add_argument("--exclude-types", nargs="+", default=[], metavar="TYPE",
+                    help="drop these IFC types and their subtypes, e.g. IfcPropertySet IfcRelAssignsToGroup")
+    args = ap.parse_args()
+    convert(pathlib.Path(args.in_ifc), pathlib.Path(args.out_json), workers=args.workers, ndjson=args.ndjson,
+            include=args.include_types, exclude=args.exclude_types)